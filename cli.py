@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+"""
+Headless entry point for scheduled jobs (cron, systemd timers).
+Does not import Qt.
+
+    python cli.py sync --all
+    python cli.py export --device 0 --from 2024-05-01 --to 2024-05-31 --format excel
+    python cli.py users --device "Main Gate"
+    python cli.py maintain
+    python cli.py import ~/exports --device "Main Gate"
+"""
+from datetime import datetime, timedelta
+import argparse
+import logging
+import sys
+import os
+
+
+def parse_date(value, end_of_day=False):
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid date: {value} (use YYYY-MM-DD or YYYY-MM-DD HH:MM:SS)")
+    if end_of_day and len(value) == 10:
+        date = date + timedelta(days=1) - timedelta(seconds=1)
+    return date
+
+
+def select_devices(settings, selectors, use_all):
+    devices = settings.get("devices", [])
+    if not devices:
+        raise ValueError("No devices configured in settings.json")
+    if use_all:
+        return devices
+    if not selectors:
+        active_index = settings.get("last_active_index", 0)
+        if active_index >= len(devices):
+            active_index = 0
+        return [devices[active_index]]
+
+    selected = []
+    for selector in selectors:
+        if selector.isdigit() and int(selector) < len(devices):
+            selected.append(devices[int(selector)])
+            continue
+        matches = [d for d in devices if selector in (d.get("name"), d.get("ip"))]
+        if not matches:
+            raise ValueError(f"No configured device matches '{selector}'")
+        selected.extend(matches)
+    return selected
+
+
+def open_controller(device_config, db_manager):
+    from modules.zk_interaction_utils import ZKDeviceController
+
+    controller = ZKDeviceController(
+        ip_address=device_config["ip"],
+        port=device_config["port"],
+        timeout=device_config["timeout"],
+        password=device_config["password"],
+        db_manager=db_manager,
+        ommit_ping=device_config.get("ommit_ping", False),
+    )
+    # Employees keep punching while a scheduled job runs
+    controller.short_lock = True
+    controller.create_zk_instance()
+    controller.connect_to_device()
+    return controller
+
+
+def run_sync(args, settings, db_manager):
+    failed = 0
+    for device_config in select_devices(settings, args.device, args.all):
+        name = device_config.get("name", device_config["ip"])
+        try:
+            controller = open_controller(device_config, db_manager)
+            try:
+                count = controller.sync_attendance(db_manager)
+            finally:
+                controller.disconnect_from_device()
+            print(f"{name}: {count} new punches")
+        except ValueError as e:
+            failed += 1
+            print(f"{name}: FAILED ({e})", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def run_export(args, settings, db_manager):
+    from modules.data_converter import DataConverter
+
+    # A bad --format fails here, before any device is touched
+    converter = DataConverter(file_format=args.format)
+    if args.output_dir:
+        converter.export_path = args.output_dir
+
+    failed = 0
+    for device_config in select_devices(settings, args.device, args.all):
+        name = device_config.get("name", device_config["ip"])
+        try:
+            controller = open_controller(device_config, db_manager)
+            try:
+                if not args.no_sync:
+                    controller.sync_attendance(db_manager)
+                file_path, count, reused = converter.convert_punches_to_file(
+                    db_manager, controller.device_key, args.start, args.end
+                )
+            finally:
+                controller.disconnect_from_device()
+
+            if not count:
+                os.remove(file_path)
+                print(f"{name}: no records in range")
+            else:
+                print(f"{name}: exported {count} records to {file_path}{' (unchanged, reused)' if reused else ''}")
+        except ValueError as e:
+            failed += 1
+            print(f"{name}: FAILED ({e})", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def run_users(args, settings, db_manager):
+    from modules.data_converter import DataConverter
+
+    # A bad --format fails here, before any device is touched
+    converter = DataConverter(file_format=args.format)
+    if args.output_dir:
+        converter.export_path = args.output_dir
+
+    failed = 0
+    for device_config in select_devices(settings, args.device, args.all):
+        name = device_config.get("name", device_config["ip"])
+        try:
+            controller = open_controller(device_config, db_manager)
+            try:
+                users = controller.retrieve_users_data()
+                if users:
+                    controller.update_user_cache(users)
+            finally:
+                controller.disconnect_from_device()
+
+            if not users:
+                print(f"{name}: no users found")
+                continue
+            file_path = converter.convert_users_to_file(users)
+            print(f"{name}: exported {len(users)} users to {file_path}")
+        except ValueError as e:
+            failed += 1
+            print(f"{name}: FAILED ({e})", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def run_maintain(args, settings, db_manager):
+    # Closed months move to archive files, expired data is dropped, then space is reclaimed
+    keep_months = args.keep_months if args.keep_months is not None else settings.get("archive_after_months", 3)
+    retention = args.retention_months if args.retention_months is not None else settings.get("retention_months")
+
+    archived = db_manager.archive_closed_months(keep_months)
+    print(f"Archived {len(archived)} month(s){': ' + ', '.join(archived) if archived else ''}")
+    if retention:
+        removed = db_manager.apply_retention(retention)
+        print(f"Removed {len(removed)} archive(s) past the {retention} month retention")
+    pruned = db_manager.prune_export_cache()
+    print(f"Dropped {pruned} cached export(s) whose file is gone or changed")
+    db_manager.vacuum()
+    print("Vacuumed and checkpointed the database")
+    return 0
+
+
+def run_import(args, settings, db_manager):
+    from modules.spreadsheet_importer import import_attendance_files
+
+    devices = select_devices(settings, args.device, False)
+    if len(devices) != 1:
+        raise ValueError("Import needs exactly one --device, the files do not say which terminal they came from")
+    device_config = devices[0]
+
+    def progress(done, total, file_path, rows):
+        print(f"[{done}/{total}] {os.path.basename(file_path)}: {rows} rows", end="\r", flush=True)
+
+    summary = import_attendance_files(
+        db_manager, args.paths, f"{device_config['ip']}:{device_config['port']}",
+        device_name=device_config.get("name"), progress=progress
+    )
+    print()
+    print(f"Imported {summary['files']} file(s), {summary['records']} records "
+          f"({summary['new']} new punches), skipped {summary['skipped']} already imported")
+    for file_path, error in summary["failed"].items():
+        print(f"{file_path}: FAILED ({error})", file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ZK attendance sync and export without the GUI")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_device_args(sub):
+        sub.add_argument("--device", action="append",
+                         help="Device index, name or IP from settings.json (repeatable, default: last active)")
+        sub.add_argument("--all", action="store_true", help="Use every configured device")
+
+    def add_output_args(sub):
+        sub.add_argument("--format", help="Output format: excel, csv, excel_csv (CSV with a BOM for Excel), "
+                                          "jsonl or parquet (default: settings file_format)")
+        sub.add_argument("--output-dir", help="Export directory (default: settings export_path)")
+
+    sync = subparsers.add_parser("sync", help="Incrementally sync punches into the local database")
+    add_device_args(sync)
+    sync.set_defaults(handler=run_sync)
+
+    export = subparsers.add_parser("export", help="Export attendance to a file")
+    add_device_args(export)
+    add_output_args(export)
+    export.add_argument("--from", dest="start", type=parse_date, help="Start date, YYYY-MM-DD[ HH:MM:SS]")
+    export.add_argument("--to", dest="end", type=lambda v: parse_date(v, end_of_day=True),
+                        help="End date, YYYY-MM-DD[ HH:MM:SS] (a bare date includes the whole day)")
+    export.add_argument("--no-sync", action="store_true", help="Export from the local database only")
+    export.set_defaults(handler=run_export)
+
+    users = subparsers.add_parser("users", help="Export the user directory to a file")
+    add_device_args(users)
+    add_output_args(users)
+    users.set_defaults(handler=run_users)
+
+    maintain = subparsers.add_parser("maintain", help="Archive closed months, apply retention and vacuum")
+    maintain.add_argument("--keep-months", type=int,
+                          help="Closed months kept in the main database (default: settings archive_after_months, 3)")
+    maintain.add_argument("--retention-months", type=int,
+                          help="Delete data older than this many months (default: settings retention_months, off)")
+    maintain.set_defaults(handler=run_maintain)
+
+    import_ = subparsers.add_parser("import", help="Import old attendance_*.xlsx exports into the history")
+    import_.add_argument("paths", nargs="+", help="Export files or directories holding them")
+    import_.add_argument("--device", action="append",
+                         help="Device index, name or IP the files came from (default: last active)")
+    import_.set_defaults(handler=run_import)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s")
+
+    if getattr(args, "output_dir", None):
+        args.output_dir = os.path.abspath(args.output_dir)
+    if getattr(args, "paths", None):
+        args.paths = [os.path.abspath(p) for p in args.paths]
+    if hasattr(args, "start") and bool(args.start) != bool(args.end):
+        parser.error("--from and --to must be given together")
+
+    # settings.json and hrms_data.db live next to the app, wherever cron starts us
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    from modules.database import DatabaseManager
+    from modules.data_converter import read_settings
+
+    settings = read_settings()
+    if hasattr(args, "format") and not args.format:
+        args.format = settings.get("file_format", "excel")
+
+    try:
+        return args.handler(args, settings, DatabaseManager())
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,61 +1,273 @@
 from datetime import datetime
-import pandas as pd
+import shutil
+import csv
 import os
 import json
 
+from modules.attendance_batch import AttendanceBatch
+
+# pandas, openpyxl and pyarrow are imported where they are used, they dominate
+# start-up time and the window does not need them until the first export
+
+# settings['file_format'] -> (extension, writer). Writers take an iterable of
+# rows and write them as they arrive, nothing is collected first
+FILE_WRITERS = {
+    "excel": (".xlsx", "_stream_to_excel"),
+    "csv": (".csv", "_stream_to_csv"),
+    # CSV with a UTF-8 BOM, for opening in Excel; other readers see it in the first header
+    "excel_csv": (".csv", "_stream_to_excel_csv"),
+    "jsonl": (".jsonl", "_stream_to_jsonl"),
+    "parquet": (".parquet", "_stream_to_parquet"),
+}
+
+# Rows per Parquet row group, also the most rows the Parquet writer holds
+PARQUET_ROW_GROUP = 50000
+
+# Parquet column types, fixed up front instead of inferred from the first
+# row group; columns not listed are written as strings
+PARQUET_TYPES = {
+    "User ID": "string", "Name": "string", "Time": "timestamp", "Type": "string", "Status": "int16",
+    "Device": "string", "id": "string", "name": "string", "timestamp": "timestamp", "punch": "int16",
+}
+PARQUET_CONVERTERS = {
+    "string": str,
+    "timestamp": lambda value: datetime.fromisoformat(value) if isinstance(value, str) else value,
+    "int16": int,
+}
+
+# Rows turned back into Python values at a time when writing a DataFrame
+FRAME_CHUNK_ROWS = 50000
+
+# Rows an xlsx sheet can hold, header included; longer exports continue on
+# Sheet2, Sheet3, ...
+EXCEL_MAX_ROWS = 1048576
+
 
 class DataConverter:
-    def __init__(self, file_format='excel'):
-        self.file_format = file_format
-        self.export_path = read_settings()['export_path']
+    def __init__(self, file_format=None):
+        settings = read_settings()
+        # Settings takes free text, "CSV " is still csv
+        self.file_format = (file_format or settings.get('file_format') or 'excel').strip().lower()
+        if self.file_format not in FILE_WRITERS:
+            raise ValueError(f"Unsupported file format: {self.file_format}")
+        self.export_path = settings['export_path']
     
     def convert_att_to_file(self, att_data):
         file_name = f"attendance_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
-        aslist = []
 
         is_dict = len(att_data) > 0 and isinstance(att_data[0], dict)
-
-        for record in att_data:
-            if is_dict:
-                aslist.append([
-                    record.get("User ID"),
-                    record.get("Name"),
-                    record.get("Time"),
-                    record.get("Type"),
-                    record.get("Status")
-                ])
-                columns = ["User ID", "Name", "Time", "Type", "Status"]
-            else:
-                aslist.append([record.user_id, record.timestamp, record.punch])
-                columns = ["id", "timestamp", "punch"]
+        if isinstance(att_data, AttendanceBatch):
+            columns = ["User ID", "Name", "Time", "Type", "Status"]
+            rows = att_data.rows()
+        elif is_dict:
+            columns = ["User ID", "Name", "Time", "Type", "Status"]
+            # Merged harvests tag each record with the terminal it came from
+            if "Device" in att_data[0]:
+                columns.append("Device")
+            rows = ([record.get(column) for column in columns] for record in att_data)
+        else:
+            columns = ["id", "timestamp", "punch"]
+            rows = ([record.user_id, record.timestamp, record.punch] for record in att_data)
                 
         if self.export_path:
             file_name = os.path.join(self.export_path, file_name)
-        if self.file_format == 'excel':
-            file_name += ".xlsx" 
-            self._convert_to_excel(aslist, columns, file_name)
-        # Add support for other formats here
-        else:
-            raise ValueError(f"Unsupported file format: {self.file_format}")
+        return self._write_rows(rows, columns, file_name)
+
+    def convert_att_batches_to_file(self, batches):
+        """
+        Write merged attendance arriving as an iterable of batches
+        (AttendanceBatch or lists of dicts) without holding the whole log.
+        Returns (file_name, record_count).
+        """
+        file_name = f"attendance_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        if self.export_path:
+            file_name = os.path.join(self.export_path, file_name)
+
+        counter = [0]
+
+        def rows():
+            for batch in batches:
+                counter[0] += len(batch)
+                if isinstance(batch, AttendanceBatch):
+                    yield from batch.rows()
+                    continue
+                for record in batch:
+                    yield [
+                        record.get("User ID"),
+                        record.get("Name"),
+                        record.get("Time"),
+                        record.get("Type"),
+                        record.get("Status")
+                    ]
+
+        columns = ["User ID", "Name", "Time", "Type", "Status"]
+        file_name = self._write_rows(rows(), columns, file_name)
+        return file_name, counter[0]
+
+    def convert_att_frame_to_file(self, frame):
+        """
+        Write an attendance DataFrame (User ID, Name, Time, Type, Status), as
+        returned by retrieve_attendance_frame or get_punches_frame.
+        """
+        file_name = f"attendance_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        if self.export_path:
+            file_name = os.path.join(self.export_path, file_name)
+        columns = ["User ID", "Name", "Time", "Type", "Status"]
+        return self._write_rows(frame_rows(frame, columns), columns, file_name)
+
+    def convert_punches_to_file(self, db_manager, device, start_date=None, end_date=None):
+        """
+        Write a device's stored punches in the range, reusing the file of an
+        earlier export in this format when the punches have not changed
+        since. Returns (file_name, record_count, reused); a reused file is
+        copied to a fresh name, so every export still gets its own file.
+        """
+        fingerprint = db_manager.punch_fingerprint(device, start_date, end_date)
+        cached = db_manager.get_cached_export(device, self.file_format, fingerprint, start_date, end_date)
+        if cached:
+            source, count = cached
+            file_name = f"attendance_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+            if self.export_path:
+                file_name = os.path.join(self.export_path, file_name)
+            file_name = reserve_file_name(file_name, FILE_WRITERS[self.file_format][0])
+            shutil.copyfile(source, file_name)
+            return file_name, count, True
+
+        file_name, count = self.convert_att_batches_to_file(db_manager.iter_punches(device, start_date, end_date))
+        if count:
+            db_manager.save_cached_export(device, self.file_format, fingerprint, file_name, count,
+                                          start_date, end_date)
+        return file_name, count, False
 
     def convert_users_to_file(self, users_data):
         file_name = f"users_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
-        aslist = []
-        for record in users_data:
-            aslist.append([record.user_id, record.name])
         if self.export_path:
             file_name = os.path.join(self.export_path, file_name)
 
-        if self.file_format == 'excel':
-            file_name += ".xlsx"
-            self._convert_to_excel(aslist, ["id", "name"],file_name)
-        # Add support for other formats here
-        else:
-            raise ValueError(f"Unsupported file format: {self.file_format}")
-    def _convert_to_excel(self, aslist, columns, file_name):
-        df = pd.DataFrame(data=aslist, columns=columns)
-        df.to_excel(file_name, index=False)
-        
+        rows = ([record.user_id, record.name] for record in users_data)
+        return self._write_rows(rows, ["id", "name"], file_name)
+
+    def _write_rows(self, rows, columns, file_name):
+        # Streams rows with the writer for file_format, returns file_name with its extension
+        extension, writer = FILE_WRITERS[self.file_format]
+        file_name = reserve_file_name(file_name, extension)
+        try:
+            getattr(self, writer)(rows, columns, file_name)
+        except BaseException:
+            # Neither the reserved name nor a half-written file is left behind
+            if os.path.exists(file_name):
+                os.remove(file_name)
+            raise
+        return file_name
+
+    def _stream_to_excel(self, rows, columns, file_name):
+        # openpyxl write-only mode flushes rows as they come, memory stays flat
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = None
+        sheet_rows = EXCEL_MAX_ROWS
+        for row in rows:
+            if sheet_rows >= EXCEL_MAX_ROWS:
+                sheet = workbook.create_sheet(f"Sheet{len(workbook.worksheets) + 1}")
+                sheet.append(columns)
+                sheet_rows = 1
+            sheet.append(row)
+            sheet_rows += 1
+        if sheet is None:
+            workbook.create_sheet("Sheet1").append(columns)
+        workbook.save(file_name)
+
+    def _stream_to_csv(self, rows, columns, file_name, encoding="utf-8"):
+        # Times as "YYYY-MM-DD HH:MM:SS"
+        with open(file_name, "w", newline="", encoding=encoding) as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+
+    def _stream_to_excel_csv(self, rows, columns, file_name):
+        # BOM so Excel shows Arabic names instead of mojibake
+        self._stream_to_csv(rows, columns, file_name, encoding="utf-8-sig")
+
+    def _stream_to_jsonl(self, rows, columns, file_name):
+        # One object per line, keyed by column name
+        encoder = json.JSONEncoder(ensure_ascii=False, default=str)
+        with open(file_name, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(encoder.encode(dict(zip(columns, row))))
+                f.write("\n")
+
+    def _stream_to_parquet(self, rows, columns, file_name):
+        # pyarrow is optional, only this format needs it
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+
+        arrow_types = {"string": pa.string(), "timestamp": pa.timestamp("s"), "int16": pa.int16()}
+        schema = pa.schema([(column, arrow_types[PARQUET_TYPES.get(column, "string")]) for column in columns])
+        writer = pq.ParquetWriter(file_name, schema)
+        try:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= PARQUET_ROW_GROUP:
+                    self._write_parquet_group(pa, writer, batch)
+                    batch = []
+            if batch:
+                self._write_parquet_group(pa, writer, batch)
+        except BaseException:
+            # No half-written file left behind
+            writer.close()
+            os.remove(file_name)
+            raise
+        writer.close()
+
+    def _write_parquet_group(self, pa, writer, batch):
+        # Values converted to the fixed schema: a group of mixed numeric and
+        # alphanumeric ids, or one that is all None, cannot change a column's type
+        arrays = []
+        for field, values in zip(writer.schema, zip(*batch)):
+            convert = PARQUET_CONVERTERS[PARQUET_TYPES.get(field.name, "string")]
+            arrays.append(pa.array([None if v is None else convert(v) for v in values], type=field.type))
+        writer.write_table(pa.Table.from_arrays(arrays, schema=writer.schema))
+
+
+def reserve_file_name(file_name, extension):
+    """
+    file_name + extension, or file_name_2 + extension, ... when that is
+    taken. Names only have one-second resolution, several devices exported
+    in the same second would otherwise overwrite each other. The file is
+    created empty here, so concurrent exports cannot pick the same name.
+    """
+    candidate, n = file_name + extension, 2
+    while True:
+        try:
+            with open(candidate, "x"):
+                return candidate
+        except FileExistsError:
+            candidate, n = f"{file_name}_{n}{extension}", n + 1
+
+
+def frame_rows(frame, columns, chunk_rows=FRAME_CHUNK_ROWS):
+    # Row tuples of plain Python values (datetime, int, str, None), one chunk of columns at a time
+    import pandas as pd
+
+    for start in range(0, len(frame), chunk_rows):
+        chunk = frame.iloc[start:start + chunk_rows]
+        values = []
+        for column in columns:
+            series = chunk[column]
+            if series.dtype.kind == "M":
+                values.append(pd.DatetimeIndex(series).to_pydatetime())
+            elif series.hasnans:
+                values.append(series.astype(object).where(series.notna(), None).tolist())
+            else:
+                values.append(series.tolist())
+        yield from zip(*values)
+
+
 def read_settings():
     # Read settings from JSON file
     with open('settings.json', 'r') as file:
@@ -1,16 +1,320 @@
-
 import sqlite3
+import hashlib
+import threading
+import logging
+import calendar
+import unicodedata
+import json
+import re
 import os
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Seconds a writer waits for another connection's transaction before
+# "database is locked", longer than any single batch holds the lock
+BUSY_TIMEOUT = 30
+
+# Applied to every connection DatabaseManager opens
+CONNECTION_PRAGMAS = (
+    # Must come first, a new file only takes it before its first table
+    "PRAGMA auto_vacuum = INCREMENTAL",
+    "PRAGMA journal_mode = WAL",
+    # WAL + NORMAL only fsyncs on checkpoint, still safe against app crashes
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    # 64 MB page cache (negative values are KiB)
+    "PRAGMA cache_size = -65536",
+    "PRAGMA mmap_size = 268435456",
+)
+
+# Rows copied per statement when a migration rebuilds a large table
+MIGRATION_CHUNK_ROWS = 50000
+
+# Rows fetched per step when building a columnar (DataFrame) result
+FRAME_FETCH_ROWS = 50000
+
+# QDateTime.toString() default, older export_logs rows stored it verbatim
+QT_DEFAULT_DATE_FORMAT = "%a %b %d %H:%M:%S %Y"
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch(value):
+    """
+    Integer seconds for a punch or filter time. Times are wall clock on the
+    terminal, so they are read as UTC, the same as SQLite's strftime('%s').
+    Returns None for values that are not a recognisable time.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            try:
+                value = datetime.strptime(value, QT_DEFAULT_DATE_FORMAT)
+            except ValueError:
+                return None
+    return calendar.timegm(value.timetuple())
+
+
+def from_epoch(value):
+    if value is None:
+        return None
+    return EPOCH + timedelta(seconds=value)
+
+
+# Arabic letter variants folded to one form, and the marks stripped, before
+# names are indexed or searched
+ARABIC_FOLDS = str.maketrans({
+    "\u0623": "\u0627", "\u0625": "\u0627", "\u0622": "\u0627", "\u0671": "\u0627",
+    "\u0649": "\u064a", "\u0626": "\u064a", "\u0624": "\u0648", "\u0629": "\u0647",
+})
+ARABIC_MARKS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+
+
+def normalize_name(name):
+    # NFKC also maps Arabic presentation forms back to plain letters
+    name = unicodedata.normalize("NFKC", name or "")
+    name = ARABIC_MARKS.sub("", name)
+    return name.translate(ARABIC_FOLDS).casefold()
+
+
+def name_matches(name, terms):
+    # terms: normalized words of a search, each must appear somewhere in the name
+    name = normalize_name(name)
+    return all(term in name for term in terms)
+
+
+SECONDS_PER_DAY = 86400
+
+# Rebuilds daily_attendance rows from punches. Worked time pairs punches in
+# order (1st-2nd, 3rd-4th, ...), a trailing unpaired punch adds nothing
+DAILY_ATTENDANCE_UPSERT = '''
+    INSERT OR REPLACE INTO daily_attendance
+        (device, user_id, day, first_in, last_out, punch_count, worked_seconds)
+'''
+# Punches of the (device, user, day) buckets listed in {buckets}, the
+# buckets driving the loop so each one is an index range scan
+DAILY_BUCKETS_SOURCE = '''
+    {buckets} CROSS JOIN punches
+    ON device = bucket_device AND user_id = bucket_user_id
+    AND timestamp BETWEEN bucket_day * 86400 AND bucket_day * 86400 + 86399
+'''
+DAILY_ATTENDANCE_SELECT = '''
+    SELECT device, user_id, day, MIN(timestamp), MAX(timestamp), COUNT(*),
+        SUM(CASE WHEN rn % 2 = 1 AND next_timestamp IS NOT NULL THEN next_timestamp - timestamp ELSE 0 END)
+    FROM (
+        SELECT device, user_id, timestamp / 86400 AS day, timestamp,
+            ROW_NUMBER() OVER bucket AS rn,
+            LEAD(timestamp) OVER bucket AS next_timestamp
+        FROM {source}
+        WINDOW bucket AS (PARTITION BY device, user_id, timestamp / 86400 ORDER BY timestamp)
+    )
+    GROUP BY device, user_id, day
+'''
+
+# Closed months of punches live in one archive file per month, with the
+# same punches/export_punches layout as the hot database
+ARCHIVE_SCHEMA = (
+    '''
+        CREATE TABLE IF NOT EXISTS {schema}.punches (
+            id INTEGER PRIMARY KEY,
+            device TEXT,
+            user_id INTEGER,
+            name TEXT,
+            timestamp INTEGER NOT NULL,
+            punch_type TEXT,
+            status INTEGER,
+            UNIQUE(device, user_id, timestamp)
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS {schema}.export_punches (
+            export_id INTEGER,
+            punch_id INTEGER,
+            PRIMARY KEY(export_id, punch_id)
+        ) WITHOUT ROWID
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS {schema}.idx_punches_device_time
+        ON punches(device, timestamp, user_id, name, punch_type, status)
+    ''',
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_export_punches_punch ON export_punches(punch_id)",
+)
+
+
+def month_bounds(timestamp):
+    # (start, end) epoch seconds of the month holding timestamp, end exclusive
+    date = from_epoch(timestamp)
+    start = datetime(date.year, date.month, 1)
+    end = datetime(date.year + date.month // 12, date.month % 12 + 1, 1)
+    return to_epoch(start), to_epoch(end)
+
+
+def months_ago(count):
+    # Epoch start of the month count months before the current one
+    now = datetime.now()
+    index = now.year * 12 + now.month - 1 - count
+    return to_epoch(datetime(index // 12, index % 12 + 1, 1))
+
+
+# Period start for the summary rollups, day is days since 1970-01-01 (a Thursday)
+SUMMARY_PERIODS = {
+    "day": "d.day",
+    "week": "d.day - (d.day + 3) % 7",
+    "month": "CAST(julianday(date(d.day * 86400, 'unixepoch', 'start of month')) - 2440587.5 AS INTEGER)",
+}
+
+# Sort keys accepted by the paged queries, each page continues after the
+# (sort value, id) of the last row it returned. Every key is non-NULL and of
+# one type, so the row-value comparison never meets NULL and pages merged
+# from several files sort in Python exactly as SQLite sorted them; user ids
+# are stored as int or text and compare as text.
+HISTORY_SORT_COLUMNS = {
+    "timestamp": "timestamp",
+    "device": "IFNULL(device_name, '')",
+    "records": "IFNULL(record_count, 0)",
+}
+RECORD_SORT_COLUMNS = {
+    "time": "IFNULL(p.timestamp, 0)",
+    "user": "IFNULL(CAST(p.user_id AS TEXT), '')",
+    "name": "IFNULL(p.name, '')",
+    "id": "p.id",
+}
 
 class DatabaseManager:
-    def __init__(self, db_name="hrms_data.db"):
+    def __init__(self, db_name="hrms_data.db", archive_dir=None):
         self.db_name = db_name
+        # Monthly archive files, next to the database by default
+        self.archive_dir = archive_dir or os.path.join(os.path.dirname(os.path.abspath(db_name)), "archive")
+        # One long-lived connection per thread and file, a connection is never shared
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # See _archived_max_id
+        self._archive_max_id = None
+        self._archive_ids_lock = threading.Lock()
         self.init_db()
 
+    def _open(self, path):
+        # isolation_level=None: transactions are opened explicitly in transaction().
+        # check_same_thread=False only so close() can run from the owning window.
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, cached_statements=256,
+                               check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        with self._connections_lock:
+            self._connections.append((path, conn))
+        return conn
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open(self.db_name)
+            self._local.conn = conn
+        return conn
+
+    def _archive_connection(self, file_name):
+        cache = getattr(self._local, "archives", None)
+        if cache is None:
+            cache = self._local.archives = {}
+        conn = cache.get(file_name)
+        if conn is not None:
+            try:
+                conn.total_changes
+                return conn
+            except sqlite3.ProgrammingError:
+                # Closed when apply_retention removed the file
+                pass
+        os.makedirs(self.archive_dir, exist_ok=True)
+        conn = self._open(os.path.join(self.archive_dir, file_name))
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement.format(schema="main"))
+        cache[file_name] = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the block as one transaction on this thread's connection.
+        Nested use joins the outer transaction, so bulk jobs can wrap many
+        calls into a single commit.
+        """
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+    def release_thread(self):
+        """
+        Close the calling thread's connections. Worker threads call this when
+        they finish; the thread opens new ones if it touches the store again.
+        """
+        conns = [getattr(self._local, "conn", None)] + list(getattr(self._local, "archives", {}).values())
+        conns = [c for c in conns if c is not None]
+        if not conns:
+            return
+        self._local.conn = None
+        self._local.archives = {}
+        with self._connections_lock:
+            self._connections = [(p, c) for p, c in self._connections if not any(c is o for o in conns)]
+        for conn in conns:
+            conn.close()
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for _path, conn in connections:
+            conn.close()
+        self._local = threading.local()
+
     def init_db(self):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+        # Schema changes are applied in order, PRAGMA user_version records the
+        # last one a database has seen
+        migrations = [
+            self._migrate_v1_base_schema,
+            self._migrate_v2_epoch_timestamps,
+            self._migrate_v3_name_search,
+            self._migrate_v4_daily_attendance,
+            self._migrate_v5_archives,
+            self._migrate_v6_export_cache,
+            self._migrate_v7_daily_dirty,
+            self._migrate_v8_trigram_names,
+        ]
+        conn = self.connection()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # An existing file only switches to incremental vacuum with a full VACUUM, done once
+            logging.info(f"Enabling incremental vacuum on {self.db_name}")
+            conn.execute("VACUUM")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= len(migrations):
+            return
+
+        # Table rebuilds need foreign keys off, it cannot change inside a transaction
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            for target, migrate in enumerate(migrations[version:], version + 1):
+                with self.transaction() as conn:
+                    migrate(conn.cursor())
+                    violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+                    if violations:
+                        raise ValueError(f"Schema migration {target} broke {len(violations)} foreign key(s)")
+                    conn.execute(f"PRAGMA user_version = {target}")
+                logging.info(f"Database {self.db_name} migrated to schema version {target}")
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+
+    def _migrate_v1_base_schema(self, cursor):
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS export_logs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -22,91 +326,1045 @@ class DatabaseManager:
                 timestamp TEXT
             )
         ''')
+        # Canonical punch store, each distinct punch is stored once
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS attendance_records (
+            CREATE TABLE IF NOT EXISTS punches (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                export_id INTEGER,
+                device TEXT,
                 user_id INTEGER,
                 name TEXT,
                 timestamp TEXT,
                 punch_type TEXT,
                 status INTEGER,
-                FOREIGN KEY(export_id) REFERENCES export_logs(id) ON DELETE CASCADE
+                UNIQUE(device, user_id, timestamp)
             )
         ''')
-        conn.commit()
-        conn.close()
-
-    def log_export(self, device_name, record_count, file_path, start_date=None, end_date=None):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute('''
-            INSERT INTO export_logs (device_name, record_count, file_path, filter_start, filter_end, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (device_name, record_count, file_path, str(start_date), str(end_date), timestamp))
-        export_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return export_id
-
-    def save_export_records(self, export_id, records):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
+        # Exports only reference the punches they contained
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS export_punches (
+                export_id INTEGER,
+                punch_id INTEGER,
+                PRIMARY KEY(export_id, punch_id),
+                FOREIGN KEY(export_id) REFERENCES export_logs(id) ON DELETE CASCADE,
+                FOREIGN KEY(punch_id) REFERENCES punches(id)
+            ) WITHOUT ROWID
+        ''')
+        # Covers the device + time range reads without touching the table
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_punches_device_time
+            ON punches(device, timestamp, user_id, name, punch_type, status)
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_punches_user_time ON punches(user_id, timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_export_punches_punch ON export_punches(punch_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_export_logs_timestamp ON export_logs(timestamp)")
+        self._migrate_attendance_records(cursor)
+        # Per-device high-water mark of the last sync
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS device_sync_state (
+                device TEXT PRIMARY KEY,
+                last_timestamp TEXT,
+                record_count INTEGER,
+                synced_at TEXT
+            )
+        ''')
+        # Cached user directory, invalidated by the sizes read_sizes reports
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS device_users (
+                device TEXT,
+                user_id TEXT,
+                name TEXT,
+                PRIMARY KEY(device, user_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS device_users_state (
+                device TEXT PRIMARY KEY,
+                user_count INTEGER,
+                finger_count INTEGER,
+                cached_at TEXT
+            )
+        ''')
+
+    def _migrate_attendance_records(self, cursor):
+        # Older databases copied every record per export into attendance_records
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'attendance_records'")
+        if cursor.fetchone() is None:
+            return
+        # Exports only recorded the device's display name, new punches are keyed
+        # by "ip:port"; names no configured device carries are kept as they are
+        cursor.execute("CREATE TEMP TABLE migrated_devices (name TEXT PRIMARY KEY, device TEXT)")
+        cursor.executemany("INSERT OR IGNORE INTO temp.migrated_devices VALUES (?, ?)", self._device_keys_by_name())
+        cursor.execute('''
+            INSERT OR IGNORE INTO punches (device, user_id, name, timestamp, punch_type, status)
+            SELECT IFNULL(m.device, l.device_name), a.user_id, a.name, a.timestamp, a.punch_type, a.status
+            FROM attendance_records a
+            JOIN export_logs l ON l.id = a.export_id
+            LEFT JOIN temp.migrated_devices m ON m.name = l.device_name
+        ''')
+        cursor.execute('''
+            INSERT OR IGNORE INTO export_punches (export_id, punch_id)
+            SELECT a.export_id, p.id
+            FROM attendance_records a
+            JOIN export_logs l ON l.id = a.export_id
+            LEFT JOIN temp.migrated_devices m ON m.name = l.device_name
+            JOIN punches p ON p.device = IFNULL(m.device, l.device_name)
+                AND p.user_id = a.user_id AND p.timestamp = a.timestamp
+        ''')
+        cursor.execute("DROP TABLE temp.migrated_devices")
+        cursor.execute("DROP TABLE attendance_records")
+
+    def _device_keys_by_name(self):
+        # (display name, "ip:port") of the devices in the settings.json next to the database
+        path = os.path.join(os.path.dirname(os.path.abspath(self.db_name)), "settings.json")
+        try:
+            with open(path, "r") as file:
+                devices = json.load(file).get("devices", [])
+        except (OSError, ValueError) as e:
+            logging.warning(f"No device list for migrating export history ({e}), keeping device names")
+            return []
+        return [(d["name"], f"{d['ip']}:{d['port']}") for d in devices if d.get("name") and d.get("ip")]
+
+    def _migrate_v2_epoch_timestamps(self, cursor):
+        # Punch and export times become integer epoch columns (see to_epoch),
+        # so range filters are index range scans instead of string compares
+        cursor.execute('''
+            CREATE TABLE punches_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device TEXT,
+                user_id INTEGER,
+                name TEXT,
+                timestamp INTEGER NOT NULL,
+                punch_type TEXT,
+                status INTEGER,
+                UNIQUE(device, user_id, timestamp)
+            )
+        ''')
+        last_id = cursor.execute("SELECT IFNULL(MAX(id), 0) FROM punches").fetchone()[0]
+        for low in range(0, last_id, MIGRATION_CHUNK_ROWS):
+            # Keeps ids, so export_punches links stay valid
+            cursor.execute('''
+                INSERT OR IGNORE INTO punches_new (id, device, user_id, name, timestamp, punch_type, status)
+                SELECT id, device, user_id, name, CAST(strftime('%s', timestamp) AS INTEGER), punch_type, status
+                FROM punches
+                WHERE id > ? AND id <= ? AND strftime('%s', timestamp) IS NOT NULL
+            ''', (low, low + MIGRATION_CHUNK_ROWS))
+
+        # Text spellings of the same second collapse into one punch, relink
+        # their exports to the survivor
+        cursor.execute('''
+            INSERT OR IGNORE INTO export_punches (export_id, punch_id)
+            SELECT e.export_id, n.id
+            FROM export_punches e
+            JOIN punches o ON o.id = e.punch_id
+            JOIN punches_new n ON n.device = o.device AND n.user_id = o.user_id
+                AND n.timestamp = CAST(strftime('%s', o.timestamp) AS INTEGER)
+            WHERE e.punch_id NOT IN (SELECT id FROM punches_new)
+        ''')
+        cursor.execute("DELETE FROM export_punches WHERE punch_id NOT IN (SELECT id FROM punches_new)")
+        dropped = cursor.execute('''
+            SELECT COUNT(*) FROM punches WHERE id NOT IN (SELECT id FROM punches_new)
+        ''').fetchone()[0]
+        if dropped:
+            logging.warning(f"Schema migration dropped {dropped} duplicate or undated punch(es)")
+
+        cursor.execute("DROP TABLE punches")
+        cursor.execute("ALTER TABLE punches_new RENAME TO punches")
+        cursor.execute('''
+            CREATE INDEX idx_punches_device_time
+            ON punches(device, timestamp, user_id, name, punch_type, status)
+        ''')
+        cursor.execute("CREATE INDEX idx_punches_user_time ON punches(user_id, timestamp)")
+
+        cursor.execute('''
+            CREATE TABLE export_logs_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_name TEXT,
+                record_count INTEGER,
+                filter_start INTEGER,
+                filter_end INTEGER,
+                file_path TEXT,
+                timestamp INTEGER
+            )
+        ''')
+        # Small table, and filter_start/filter_end need Python to parse the Qt format
+        rows = cursor.execute('''
+            SELECT id, device_name, record_count, filter_start, filter_end, file_path, timestamp FROM export_logs
+        ''').fetchall()
+        cursor.executemany('''
+            INSERT INTO export_logs_new (id, device_name, record_count, filter_start, filter_end, file_path, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(r[0], r[1], r[2], to_epoch(r[3]), to_epoch(r[4]), r[5], to_epoch(r[6])) for r in rows])
+        cursor.execute("DROP TABLE export_logs")
+        cursor.execute("ALTER TABLE export_logs_new RENAME TO export_logs")
+        cursor.execute("CREATE INDEX idx_export_logs_timestamp ON export_logs(timestamp)")
+        cursor.execute("CREATE INDEX idx_export_logs_filter ON export_logs(filter_start, filter_end)")
+
+    def _migrate_v3_name_search(self, cursor):
+        # Every spelling of a user's name, with an FTS5 index over its normalized form
+        cursor.execute('''
+            CREATE TABLE user_names (
+                id INTEGER PRIMARY KEY,
+                device TEXT,
+                user_id INTEGER,
+                name TEXT,
+                UNIQUE(device, user_id, name)
+            )
+        ''')
+        cursor.execute('''
+            CREATE VIRTUAL TABLE user_names_fts USING fts5(
+                name, content='', tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+        rows = cursor.connection.execute("SELECT DISTINCT device, user_id, name FROM punches")
+        while True:
+            batch = rows.fetchmany(MIGRATION_CHUNK_ROWS)
+            if not batch:
+                break
+            self._index_names(cursor, batch)
+
+    def _migrate_v4_daily_attendance(self, cursor):
+        # Per user per day summary, kept current by refresh_daily_attendance.
+        # Keyed day before user so period queries are a range scan
+        cursor.execute('''
+            CREATE TABLE daily_attendance (
+                device TEXT,
+                user_id INTEGER,
+                day INTEGER,
+                first_in INTEGER,
+                last_out INTEGER,
+                punch_count INTEGER,
+                worked_seconds INTEGER,
+                PRIMARY KEY(device, day, user_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(DAILY_ATTENDANCE_UPSERT + DAILY_ATTENDANCE_SELECT.format(source="punches"))
+
+    def _migrate_v5_archives(self, cursor):
+        # Registry of monthly archive files, [start, end) in epoch seconds
+        cursor.execute('''
+            CREATE TABLE archives (
+                month TEXT PRIMARY KEY,
+                file_name TEXT,
+                start INTEGER,
+                end INTEGER,
+                punch_count INTEGER,
+                archived_at INTEGER
+            )
+        ''')
+
+    def _migrate_v6_export_cache(self, cursor):
+        # Files written from the store, reused while the punches they hold are
+        # unchanged; start and end are -1 for an export of the whole log
+        cursor.execute('''
+            CREATE TABLE export_cache (
+                device TEXT NOT NULL,
+                start INTEGER NOT NULL,
+                end INTEGER NOT NULL,
+                file_format TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                file_size INTEGER,
+                file_mtime INTEGER,
+                record_count INTEGER,
+                created_at INTEGER,
+                PRIMARY KEY(device, start, end, file_format)
+            ) WITHOUT ROWID
+        ''')
+
+    def _migrate_v7_daily_dirty(self, cursor):
+        # (device, user, day) buckets with punches saved since daily_attendance
+        # last caught up, see refresh_daily_attendance
+        cursor.execute('''
+            CREATE TABLE daily_dirty (
+                bucket_device TEXT,
+                bucket_user_id INTEGER,
+                bucket_day INTEGER,
+                PRIMARY KEY(bucket_device, bucket_user_id, bucket_day)
+            ) WITHOUT ROWID
+        ''')
+
+    def _migrate_v8_trigram_names(self, cursor):
+        # Trigram tokens match anywhere in a name, not only at word starts: Arabic
+        # names are often written joined ("عبدالرحمن"), a prefix search misses them
+        cursor.execute("DROP TABLE user_names_fts")
+        cursor.execute('''
+            CREATE VIRTUAL TABLE user_names_fts USING fts5(
+                name, content='', tokenize='trigram'
+            )
+        ''')
+        rows = cursor.connection.execute("SELECT id, name FROM user_names")
+        while True:
+            batch = rows.fetchmany(MIGRATION_CHUNK_ROWS)
+            if not batch:
+                break
+            cursor.executemany(
+                "INSERT INTO user_names_fts (rowid, name) VALUES (?, ?)",
+                [(row_id, normalize_name(name)) for row_id, name in batch]
+            )
+
+    def _daily_buckets(self, rows):
+        # rows: (device, user_id, timestamp) of saved punches
+        return {(device, user_id, timestamp // SECONDS_PER_DAY) for device, user_id, timestamp in rows
+                if timestamp is not None}
+
+    def _mark_daily_dirty(self, conn, rows):
+        # Saves only note the buckets they touched; a bulk load would otherwise
+        # recompute the same bucket once per batch
+        conn.executemany("INSERT OR IGNORE INTO daily_dirty VALUES (?, ?, ?)", self._daily_buckets(rows))
+
+    def refresh_daily_attendance(self):
+        # Recompute the dirty buckets in one statement; readers of
+        # daily_attendance and jobs that move punches call this first
+        if self.connection().execute("SELECT 1 FROM daily_dirty LIMIT 1").fetchone() is None:
+            return
+        with self.transaction() as conn:
+            conn.execute(DAILY_ATTENDANCE_UPSERT + DAILY_ATTENDANCE_SELECT.format(
+                source=DAILY_BUCKETS_SOURCE.format(buckets="daily_dirty")
+            ))
+            conn.execute("DELETE FROM daily_dirty")
+
+    def _archives(self, start_ts=None, end_ts=None):
+        # (file_name, start, end) of archives overlapping [start_ts, end_ts], oldest first
+        return self.connection().execute('''
+            SELECT file_name, start, end FROM archives
+            WHERE (? IS NULL OR end > ?) AND (? IS NULL OR start <= ?)
+            ORDER BY start
+        ''', (start_ts, start_ts, end_ts, end_ts)).fetchall()
+
+    def _punch_sources(self, start_ts=None, end_ts=None):
+        # Connections holding punches in range, oldest archive first, the hot database last
+        sources = [self._archive_connection(r[0]) for r in self._archives(start_ts, end_ts)]
+        sources.append(self.connection())
+        return sources
+
+    def _register_archive(self, start, end):
+        month = from_epoch(start).strftime("%Y-%m")
+        file_name = f"{os.path.splitext(os.path.basename(self.db_name))[0]}_{month}.db"
+        with self.transaction() as conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO archives (month, file_name, start, end, punch_count, archived_at)
+                VALUES (?, ?, ?, ?, 0, ?)
+            ''', (month, file_name, start, end, to_epoch(datetime.now())))
+        return file_name
+
+    def _split_archived(self, rows):
+        # Punch rows (device, user_id, name, timestamp, ...) for archived months
+        # are kept out of the hot database
+        horizon = self.connection().execute("SELECT MAX(end) FROM archives").fetchone()[0]
+        if horizon is None:
+            return rows, []
+        hot, late = [], []
+        for row in rows:
+            (late if row[3] is not None and row[3] < horizon else hot).append(row)
+        return hot, late
+
+    def _archived_max_id(self):
+        # Highest punch id written to any archive file. Known to this process
+        # rather than read from the hot database, whose sequence bump rolls
+        # back with a failed outer transaction while the archive row stays.
+        with self._archive_ids_lock:
+            if self._archive_max_id is None:
+                ids = [self._archive_connection(r[0]).execute("SELECT MAX(id) FROM punches").fetchone()[0]
+                       for r in self._archives()]
+                self._archive_max_id = max([i for i in ids if i is not None], default=0)
+            return self._archive_max_id
+
+    def _set_punch_sequence(self, conn, seq):
+        # Raise the punches AUTOINCREMENT counter to at least seq, inside the caller's transaction
+        if not conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'punches'", (seq,)).rowcount:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('punches', ?)", (seq,))
+
+    def _guard_punch_ids(self, conn):
+        # Before hot inserts: never hand out an id an archive already holds
+        archived = self._archived_max_id()
+        if archived:
+            self._set_punch_sequence(conn, archived)
+
+    def _reserve_punch_ids(self, count):
+        # Punch ids stay unique across the hot database and every archive
+        with self.transaction() as conn:
+            self._guard_punch_ids(conn)
+            first = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'punches'").fetchone()
+            first = (first[0] if first else 0) + 1
+            self._set_punch_sequence(conn, first + count - 1)
+            return first
+
+    def _save_archived_punches(self, rows, export_id=None):
+        """
+        Write punches of archived months straight into their archive files.
+        Returns (inserted, daily) where daily holds the recomputed
+        daily_attendance rows of the touched buckets.
+        """
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(month_bounds(row[3]), []).append(row)
+
+        inserted = 0
+        daily = []
+        for (start, end), month_rows in sorted(by_month.items()):
+            file_name = self._register_archive(start, end)
+            first_id = self._reserve_punch_ids(len(month_rows))
+            conn = self._archive_connection(file_name)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = conn.total_changes
+                conn.executemany('''
+                    INSERT OR IGNORE INTO punches (id, device, user_id, name, timestamp, punch_type, status)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [(first_id + i,) + tuple(row) for i, row in enumerate(month_rows)])
+                inserted += conn.total_changes - before
+                if export_id is not None:
+                    conn.executemany('''
+                        INSERT OR IGNORE INTO export_punches (export_id, punch_id)
+                        SELECT ?, id FROM punches WHERE device = ? AND user_id = ? AND timestamp = ?
+                    ''', [(export_id, r[0], r[1], r[3]) for r in month_rows])
+                # Always recomputed, a failed hot transaction may have lost them before
+                conn.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS daily_buckets (bucket_device, bucket_user_id, bucket_day)"
+                )
+                conn.execute("DELETE FROM temp.daily_buckets")
+                conn.executemany("INSERT INTO temp.daily_buckets VALUES (?, ?, ?)",
+                                 self._daily_buckets((r[0], r[1], r[3]) for r in month_rows))
+                daily.extend(conn.execute(DAILY_ATTENDANCE_SELECT.format(
+                    source=DAILY_BUCKETS_SOURCE.format(buckets="temp.daily_buckets")
+                )).fetchall())
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+            with self._archive_ids_lock:
+                self._archive_max_id = max(self._archive_max_id or 0, first_id + len(month_rows) - 1)
+        return inserted, daily
+
+    def archive_closed_months(self, keep_months=3):
+        """
+        Move punches of months that closed more than keep_months ago out of
+        the hot database into per-month archive files. Queries keep seeing
+        them. Returns the archived months as "YYYY-MM".
+        """
+        conn = self.connection()
+        if conn.in_transaction:
+            raise ValueError("Archiving cannot run inside a transaction")
+        # Dirty buckets are recomputed from the hot punches, before those move
+        self.refresh_daily_attendance()
+        cutoff = months_ago(keep_months)
+        devices = [r[0] for r in conn.execute("SELECT DISTINCT device FROM punches")]
+
+        archived = []
+        oldest = conn.execute("SELECT MIN(timestamp) FROM punches").fetchone()[0]
+        while oldest is not None and oldest < cutoff:
+            start, end = month_bounds(oldest)
+            file_name = self._register_archive(start, end)
+            # Opening it once creates the file and its schema
+            self._archive_connection(file_name)
+            conn.execute("ATTACH DATABASE ? AS archive", (os.path.join(self.archive_dir, file_name),))
+            try:
+                # Copy first and delete in a second transaction, a crash in
+                # between leaves a duplicate the next run skips, never a loss
+                with self.transaction():
+                    for device in devices:
+                        params = (device, start, end)
+                        conn.execute('''
+                            INSERT OR IGNORE INTO archive.punches
+                            SELECT id, device, user_id, name, timestamp, punch_type, status FROM main.punches
+                            WHERE device = ? AND timestamp >= ? AND timestamp < ?
+                        ''', params)
+                        conn.execute('''
+                            INSERT OR IGNORE INTO archive.export_punches (export_id, punch_id)
+                            SELECT e.export_id, e.punch_id
+                            FROM main.punches p JOIN main.export_punches e ON e.punch_id = p.id
+                            WHERE p.device = ? AND p.timestamp >= ? AND p.timestamp < ?
+                        ''', params)
+                with self.transaction():
+                    for device in devices:
+                        params = (device, start, end)
+                        conn.execute('''
+                            DELETE FROM main.export_punches WHERE punch_id IN (
+                                SELECT id FROM main.punches WHERE device = ? AND timestamp >= ? AND timestamp < ?
+                            )
+                        ''', params)
+                        conn.execute(
+                            "DELETE FROM main.punches WHERE device = ? AND timestamp >= ? AND timestamp < ?", params
+                        )
+                    conn.execute('''
+                        UPDATE archives SET punch_count = (SELECT COUNT(*) FROM archive.punches)
+                        WHERE file_name = ?
+                    ''', (file_name,))
+            finally:
+                conn.execute("DETACH DATABASE archive")
+            archived.append(from_epoch(start).strftime("%Y-%m"))
+            logging.info(f"Archived {archived[-1]} to {file_name}")
+            oldest = conn.execute("SELECT MIN(timestamp) FROM punches").fetchone()[0]
+        return archived
+
+    def apply_retention(self, keep_months):
+        """
+        Delete punches, archives, daily summaries and export logs older than
+        keep_months whole months. Returns the removed archive months.
+        """
+        cutoff = months_ago(keep_months)
+        expired = self.connection().execute(
+            "SELECT month, file_name FROM archives WHERE end <= ?", (cutoff,)
+        ).fetchall()
+
+        with self.transaction() as conn:
+            conn.execute('''
+                DELETE FROM export_punches WHERE export_id IN (SELECT id FROM export_logs WHERE timestamp < ?)
+            ''', (cutoff,))
+            conn.execute("DELETE FROM export_logs WHERE timestamp < ?", (cutoff,))
+            conn.execute('''
+                DELETE FROM export_punches WHERE punch_id IN (SELECT id FROM punches WHERE timestamp < ?)
+            ''', (cutoff,))
+            conn.execute("DELETE FROM punches WHERE timestamp < ?", (cutoff,))
+            conn.execute("DELETE FROM daily_attendance WHERE day < ?", (cutoff // SECONDS_PER_DAY,))
+            conn.execute("DELETE FROM daily_dirty WHERE bucket_day < ?", (cutoff // SECONDS_PER_DAY,))
+            conn.execute("DELETE FROM archives WHERE end <= ?", (cutoff,))
+
+        for month, file_name in expired:
+            path = os.path.join(self.archive_dir, file_name)
+            # Connections of every thread, the file cannot be removed while open
+            with self._connections_lock:
+                stale = [c for p, c in self._connections if p == path]
+                self._connections = [(p, c) for p, c in self._connections if p != path]
+            for conn in stale:
+                conn.close()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            logging.info(f"Removed archive {month} past the {keep_months} month retention")
+        return [month for month, _file_name in expired]
+
+    def vacuum(self, pages=None):
+        # Hand freed pages back to the filesystem and truncate the WAL
+        conn = self.connection()
+        if conn.in_transaction:
+            raise ValueError("Vacuum cannot run inside a transaction")
+        # executescript steps the pragma to completion, execute frees a single page
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages or 0)});")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        conn.execute("PRAGMA optimize")
+
+    def _index_names(self, conn, rows):
+        # rows: (device, user_id, name), called inside the write transaction
+        for device, user_id, name in set(rows):
+            if not name:
+                continue
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO user_names (device, user_id, name) VALUES (?, ?, ?)", (device, user_id, name)
+            )
+            if cursor.rowcount:
+                conn.execute(
+                    "INSERT INTO user_names_fts (rowid, name) VALUES (?, ?)", (cursor.lastrowid, normalize_name(name))
+                )
+
+    def log_export(self, device_name, record_count, file_path, start_date=None, end_date=None, timestamp=None):
+        timestamp = to_epoch(timestamp or datetime.now())
+        with self.transaction() as conn:
+            cursor = conn.execute('''
+                INSERT INTO export_logs (device_name, record_count, file_path, filter_start, filter_end, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (device_name, record_count, file_path, to_epoch(start_date), to_epoch(end_date), timestamp))
+            return cursor.lastrowid
+
+    def update_export(self, export_id, record_count, start_date=None, end_date=None):
+        # Imports only know the count and time span once the file is read
+        with self.transaction() as conn:
+            conn.execute('''
+                UPDATE export_logs SET record_count = ?, filter_start = ?, filter_end = ? WHERE id = ?
+            ''', (record_count, to_epoch(start_date), to_epoch(end_date), export_id))
+
+    def _punch_rows(self, records, device=None):
+        # punches rows (device, user_id, name, timestamp, punch_type, status) from an
+        # AttendanceBatch or record dicts; device overrides a record's own "Device"
+        from modules.attendance_batch import AttendanceBatch
+
+        if isinstance(records, AttendanceBatch):
+            return list(records.db_rows(device))
         data_to_insert = []
         for r in records:
-            # record dict: {"User ID", "Name", "Time", "Type", "Status"}
+            # record dict: {"User ID", "Name", "Time", "Type", "Status"}, "Device" when loaded from history
             data_to_insert.append((
-                export_id,
+                device or r.get("Device") or "Unknown",
                 r.get("User ID"),
                 r.get("Name"),
-                str(r.get("Time")),
+                to_epoch(r.get("Time")),
                 str(r.get("Type")),
                 r.get("Status")
             ))
-            
-        cursor.executemany('''
-            INSERT INTO attendance_records (export_id, user_id, name, timestamp, punch_type, status)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', data_to_insert)
-        
-        conn.commit()
-        conn.close()
+        return data_to_insert
+
+    def _new_batch(self):
+        from modules.attendance_batch import AttendanceBatch
+
+        return AttendanceBatch()
+
+    def save_export_records(self, export_id, records, device=None):
+        data_to_insert = self._punch_rows(records, device)
+        data_to_insert, late = self._split_archived(data_to_insert)
+        inserted, daily = self._save_archived_punches(late, export_id) if late else (0, [])
+
+        with self.transaction() as conn:
+            conn.executemany(DAILY_ATTENDANCE_UPSERT + "VALUES (?, ?, ?, ?, ?, ?, ?)", daily)
+            self._index_names(conn, [(d[0], d[1], d[2]) for d in late])
+            self._guard_punch_ids(conn)
+            # Store each punch once, then link the export to it
+            before = conn.total_changes
+            conn.executemany('''
+                INSERT OR IGNORE INTO punches (device, user_id, name, timestamp, punch_type, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', data_to_insert)
+            inserted += conn.total_changes - before
+            if conn.total_changes > before:
+                self._mark_daily_dirty(conn, [(d[0], d[1], d[3]) for d in data_to_insert])
+            self._index_names(conn, [(d[0], d[1], d[2]) for d in data_to_insert])
+            conn.executemany('''
+                INSERT OR IGNORE INTO export_punches (export_id, punch_id)
+                SELECT ?, id FROM punches WHERE device = ? AND user_id = ? AND timestamp = ?
+            ''', [(export_id, d[0], d[1], d[3]) for d in data_to_insert])
+            # Punches that were new to the store, the rest were already there
+            return inserted
 
     def get_export_history(self):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM export_logs ORDER BY timestamp DESC')
-        rows = cursor.fetchall()
-        conn.close()
-        return rows
+        cursor = self.connection().execute('SELECT * FROM export_logs ORDER BY timestamp DESC')
+        return [self._history_row(r) for r in cursor.fetchall()]
+
+    def _history_row(self, r):
+        # (id, device_name, record_count, filter_start, filter_end, file_path, timestamp)
+        return (r[0], r[1], r[2], from_epoch(r[3]), from_epoch(r[4]), r[5], from_epoch(r[6]))
 
     def get_export_records(self, export_id):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM attendance_records WHERE export_id = ?', (export_id,))
-        rows = cursor.fetchall()
-        conn.close()
-        
-        # Convert back to list of dicts for UI
-        records = []
-        for r in rows:
-            # db row: id, export_id, user_id, name, timestamp, punch_type, status
-            records.append({
-                "User ID": r[2],
-                "Name": r[3],
-                "Time": r[4],
-                "Type": r[5],
-                "Status": r[6]
-            })
+        # Archives hold older months, so reading them in order keeps the records in time order
+        records = self._new_batch()
+        for conn in self._punch_sources():
+            records.extend_rows(conn.execute('''
+                SELECT p.user_id, p.name, p.timestamp, p.punch_type, p.status, p.device
+                FROM export_punches e JOIN punches p ON p.id = e.punch_id
+                WHERE e.export_id = ?
+                ORDER BY p.timestamp
+            ''', (export_id,)))
+        return records
+
+    def get_export_history_page(self, page_size=100, after=None, sort_key="timestamp", descending=True):
+        """
+        One page of export_logs rows. Returns (rows, token); pass token back
+        as after for the next page, it is None once the last page is reached.
+        """
+        column = HISTORY_SORT_COLUMNS.get(sort_key)
+        if column is None:
+            raise ValueError(f"Unknown history sort key: {sort_key}")
+        op, order = ("<", "DESC") if descending else (">", "ASC")
+
+        query = f"SELECT {column}, * FROM export_logs"
+        params = []
+        if after is not None:
+            query += f" WHERE ({column}, id) {op} (?, ?)"
+            params.extend(after)
+        # One extra row tells whether another page exists
+        query += f" ORDER BY {column} {order}, id {order} LIMIT ?"
+        params.append(page_size + 1)
+        rows = self.connection().execute(query, params).fetchall()
+
+        token = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            token = (rows[-1][0], rows[-1][1])
+        return [self._history_row(r[1:]) for r in rows], token
+
+    def get_export_records_page(self, export_id, page_size=1000, after=None, sort_key="time", descending=False):
+        """
+        One page of an export's records as an AttendanceBatch, like get_export_records.
+        Returns (records, token) with the same token contract as
+        get_export_history_page.
+        """
+        column = RECORD_SORT_COLUMNS.get(sort_key)
+        if column is None:
+            raise ValueError(f"Unknown record sort key: {sort_key}")
+        op, order = ("<", "DESC") if descending else (">", "ASC")
+
+        query = f'''
+            SELECT {column}, p.id, p.user_id, p.name, p.timestamp, p.punch_type, p.status, p.device
+            FROM export_punches e JOIN punches p ON p.id = e.punch_id
+            WHERE e.export_id = ?
+        '''
+        params = [export_id]
+        if after is not None:
+            query += f" AND ({column}, p.id) {op} (?, ?)"
+            params.extend(after)
+        query += f" ORDER BY {column} {order}, p.id {order} LIMIT ?"
+        params.append(page_size + 1)
+        # Best page_size + 1 of each file, merged on the same (key, id) SQLite ordered by
+        rows = []
+        for conn in self._punch_sources():
+            rows.extend(conn.execute(query, params).fetchall())
+        rows.sort(key=lambda r: (r[0], r[1]), reverse=descending)
+
+        token = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            token = (rows[-1][0], rows[-1][1])
+
+        records = self._new_batch()
+        records.extend_rows(r[2:] for r in rows)
+        return records, token
+
+    def get_sync_state(self, device):
+        cursor = self.connection().execute(
+            'SELECT last_timestamp, record_count FROM device_sync_state WHERE device = ?', (device,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None, 0
+        return row[0], row[1]
+
+    def update_sync_state(self, device, last_timestamp, record_count):
+        synced_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.transaction() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO device_sync_state (device, last_timestamp, record_count, synced_at)
+                VALUES (?, ?, ?, ?)
+            ''', (device, str(last_timestamp) if last_timestamp else None, record_count, synced_at))
+
+    def reset_sync_state(self, device):
+        # Device log was cleared or shrank. Stored punches stay, they are
+        # history exports refer to, and the next pull dedupes against them
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM device_sync_state WHERE device = ?", (device,))
+
+    def save_punches(self, device, records):
+        data_to_insert = self._punch_rows(records, device)
+        data_to_insert, late = self._split_archived(data_to_insert)
+        inserted, daily = self._save_archived_punches(late) if late else (0, [])
+
+        with self.transaction() as conn:
+            conn.executemany(DAILY_ATTENDANCE_UPSERT + "VALUES (?, ?, ?, ?, ?, ?, ?)", daily)
+            self._index_names(conn, [(d[0], d[1], d[2]) for d in late])
+            self._guard_punch_ids(conn)
+            before = conn.total_changes
+            conn.executemany('''
+                INSERT OR IGNORE INTO punches (device, user_id, name, timestamp, punch_type, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', data_to_insert)
+            inserted += conn.total_changes - before
+            if conn.total_changes > before:
+                self._mark_daily_dirty(conn, [(d[0], d[1], d[3]) for d in data_to_insert])
+            self._index_names(conn, [(d[0], d[1], d[2]) for d in data_to_insert])
+            return inserted
+
+    def get_punches(self, device, start_date=None, end_date=None):
+        # One AttendanceBatch, filled straight from the cursors
+        records = self._new_batch()
+        for cursor in self._punch_cursors(device, start_date, end_date):
+            records.extend_rows(cursor)
+        return records
+
+    def search_punches(self, device, name_query, start_date=None, end_date=None):
+        """
+        Punches of users whose name contains every word of name_query, after
+        Arabic normalization; the same rule as name_matches, which filters a
+        direct pull. device None searches all devices.
+        """
+        terms = normalize_name(name_query).split()
+        if not terms:
+            raise ValueError("Name search needs at least one word")
+        # Trigrams need words of 3+ characters, shorter ones are checked on the candidates
+        long_terms = [term for term in terms if len(term) >= 3]
+
+        conn = self.connection()
+        query = "SELECT device, user_id, name FROM user_names WHERE 1"
+        params = []
+        if long_terms:
+            # Resolve the matching users first, so FTS is queried once
+            query += " AND id IN (SELECT rowid FROM user_names_fts WHERE user_names_fts MATCH ?)"
+            params.append(" ".join('"' + term.replace('"', '""') + '"' for term in long_terms))
+        if device is not None:
+            query += " AND device = ?"
+            params.append(device)
+        users_by_device = {}
+        for user_device, user_id, name in conn.execute(query, params):
+            if name_matches(name, terms):
+                users_by_device.setdefault(user_device, set()).add(user_id)
+
+        rows = []
+        for user_device, user_ids in users_by_device.items():
+            # (device, user_id, timestamp) is the punches unique index
+            query = '''
+                SELECT user_id, name, timestamp, punch_type, status FROM punches
+                WHERE device = ? AND user_id IN (SELECT value FROM json_each(?))
+            '''
+            params = [user_device, json.dumps(sorted(user_ids))]
+            start_ts = end_ts = None
+            if start_date and end_date:
+                start_ts, end_ts = to_epoch(start_date), to_epoch(end_date)
+                query += " AND timestamp BETWEEN ? AND ?"
+                params.extend([start_ts, end_ts])
+            for source in self._punch_sources(start_ts, end_ts):
+                rows.extend(r + (user_device,) for r in source.execute(query, params))
+        rows.sort(key=lambda r: r[2])
+        records = self._new_batch()
+        records.extend_rows(rows)
         return records
 
+    def get_attendance_summary(self, device, start_date, end_date, period="day", user_id=None):
+        """
+        First-in, last-out, punch count and worked minutes per user, rolled
+        up by day, week (Monday start) or month over [start_date, end_date].
+        device None combines every device.
+        """
+        period_start = SUMMARY_PERIODS.get(period)
+        if period_start is None:
+            raise ValueError(f"Unknown summary period: {period}")
+        self.refresh_daily_attendance()
+
+        query = f'''
+            SELECT d.user_id, {period_start} AS period, MIN(d.first_in), MAX(d.last_out),
+                COUNT(DISTINCT d.day), SUM(d.punch_count), SUM(d.worked_seconds)
+            FROM daily_attendance d
+            WHERE d.day BETWEEN ? AND ?
+        '''
+        params = [to_epoch(start_date) // SECONDS_PER_DAY, to_epoch(end_date) // SECONDS_PER_DAY]
+        if device is not None:
+            query += " AND d.device = ?"
+            params.append(device)
+        if user_id is not None:
+            query += " AND d.user_id = ?"
+            params.append(user_id)
+        query += " GROUP BY d.user_id, period ORDER BY period, d.user_id"
+
+        summary = []
+        for r in self.connection().execute(query, params):
+            summary.append({
+                "User ID": r[0],
+                "Period": from_epoch(r[1] * SECONDS_PER_DAY).date(),
+                "First In": from_epoch(r[2]),
+                "Last Out": from_epoch(r[3]),
+                "Days": r[4],
+                "Punches": r[5],
+                "Worked Minutes": r[6] // 60
+            })
+        return summary
+
+    def get_cached_users(self, device):
+        conn = self.connection()
+        state = conn.execute(
+            'SELECT user_count, finger_count FROM device_users_state WHERE device = ?', (device,)
+        ).fetchone()
+        if state is None:
+            return None, {}
+        rows = conn.execute('SELECT user_id, name FROM device_users WHERE device = ?', (device,)).fetchall()
+        user_map = {r[0]: r[1] for r in rows}
+        return (state[0], state[1]), user_map
+
+    def save_cached_users(self, device, user_map, user_count, finger_count):
+        cached_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM device_users WHERE device = ?", (device,))
+            conn.executemany('''
+                INSERT INTO device_users (device, user_id, name) VALUES (?, ?, ?)
+            ''', [(device, str(user_id), name) for user_id, name in user_map.items()])
+            conn.execute('''
+                INSERT OR REPLACE INTO device_users_state (device, user_count, finger_count, cached_at)
+                VALUES (?, ?, ?, ?)
+            ''', (device, user_count, finger_count, cached_at))
+
+    def _punch_cursors(self, device, start_date=None, end_date=None):
+        # (user_id, name, timestamp, punch_type, status) cursors for a device
+        # in time order, the archives covering the range and then the hot database
+        start_ts = end_ts = None
+        if start_date and end_date:
+            start_ts, end_ts = to_epoch(start_date), to_epoch(end_date)
+        for conn in self._punch_sources(start_ts, end_ts):
+            cursor = conn.cursor()
+            try:
+                if start_ts is not None:
+                    cursor.execute('''
+                        SELECT user_id, name, timestamp, punch_type, status FROM punches
+                        WHERE device = ? AND timestamp BETWEEN ? AND ?
+                        ORDER BY timestamp
+                    ''', (device, start_ts, end_ts))
+                else:
+                    cursor.execute('''
+                        SELECT user_id, name, timestamp, punch_type, status FROM punches
+                        WHERE device = ? ORDER BY timestamp
+                    ''', (device,))
+                yield cursor
+            finally:
+                cursor.close()
+
+    def iter_punches(self, device, start_date=None, end_date=None, batch_size=5000):
+        # AttendanceBatches of a device's punches, fetched batch_size at a time;
+        # the batches share one set of user id and name tables
+        batch = None
+        for cursor in self._punch_cursors(device, start_date, end_date):
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                batch = batch.sibling() if batch is not None else self._new_batch()
+                batch.extend_rows(rows)
+                yield batch
+
+    def _cache_range(self, start_date=None, end_date=None):
+        # export_cache (start, end), a range only counts with both ends like in _punch_cursors
+        if start_date and end_date:
+            return to_epoch(start_date), to_epoch(end_date)
+        return -1, -1
+
+    def punch_fingerprint(self, device, start_date=None, end_date=None):
+        """
+        Hash of which punches a device has in the range. Punch rows are never
+        updated and their ids are never reused, so any insert or delete
+        changes the count or the id sums. Summed over the hot database and
+        the archives, moving a month into an archive leaves it as it was.
+        Reads only idx_punches_device_time, not the rows.
+        """
+        start_ts, end_ts = self._cache_range(start_date, end_date)
+        if start_ts >= 0:
+            sources = self._punch_sources(start_ts, end_ts)
+            where, params = "device = ? AND timestamp BETWEEN ? AND ?", (device, start_ts, end_ts)
+        else:
+            sources = self._punch_sources()
+            where, params = "device = ?", (device,)
+        totals = [0, 0, 0, 0]
+        for conn in sources:
+            row = conn.execute(
+                f"SELECT COUNT(*), SUM(id), MAX(id), SUM(timestamp) FROM punches WHERE {where}", params
+            ).fetchone()
+            totals[0] += row[0]
+            totals[1] += row[1] or 0
+            totals[2] = max(totals[2], row[2] or 0)
+            totals[3] += row[3] or 0
+        return hashlib.sha256(json.dumps([device, start_ts, end_ts] + totals).encode()).hexdigest()
+
+    def get_cached_export(self, device, file_format, fingerprint, start_date=None, end_date=None):
+        """
+        (file_path, record_count) of an earlier export of the same punches,
+        or None. An entry whose file is gone or was changed since, or whose
+        punches differ, is dropped.
+        """
+        start_ts, end_ts = self._cache_range(start_date, end_date)
+        key = (device, start_ts, end_ts, file_format)
+        row = self.connection().execute('''
+            SELECT fingerprint, file_path, file_size, file_mtime, record_count FROM export_cache
+            WHERE device = ? AND start = ? AND end = ? AND file_format = ?
+        ''', key).fetchone()
+        if row is None:
+            return None
+        cached_fingerprint, file_path, file_size, file_mtime, record_count = row
+        if cached_fingerprint == fingerprint and self._file_stamp(file_path) == (file_size, file_mtime):
+            return file_path, record_count
+        with self.transaction() as conn:
+            conn.execute(
+                "DELETE FROM export_cache WHERE device = ? AND start = ? AND end = ? AND file_format = ?", key
+            )
+        return None
+
+    def save_cached_export(self, device, file_format, fingerprint, file_path, record_count,
+                           start_date=None, end_date=None):
+        start_ts, end_ts = self._cache_range(start_date, end_date)
+        file_size, file_mtime = self._file_stamp(file_path)
+        with self.transaction() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO export_cache (device, start, end, file_format, fingerprint, file_path,
+                                                     file_size, file_mtime, record_count, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (device, start_ts, end_ts, file_format, fingerprint, file_path,
+                  file_size, file_mtime, record_count, to_epoch(datetime.now())))
+
+    def prune_export_cache(self):
+        # Drops entries whose file was deleted or edited, returns how many
+        rows = self.connection().execute(
+            "SELECT device, start, end, file_format, file_path, file_size, file_mtime FROM export_cache"
+        ).fetchall()
+        stale = [r[:4] for r in rows if self._file_stamp(r[4]) != (r[5], r[6])]
+        with self.transaction() as conn:
+            conn.executemany(
+                "DELETE FROM export_cache WHERE device = ? AND start = ? AND end = ? AND file_format = ?", stale
+            )
+        return len(stale)
+
+    def _file_stamp(self, file_path):
+        # (size, mtime in ns) of a file, (None, None) when it does not exist
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None, None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _punch_frame(self, cursors, columns):
+        """
+        DataFrame from punch row cursors: "User ID" and "Status" as int64,
+        "Time" as datetime64, text columns as categoricals. Each fetched
+        chunk is typed right away, so no per-row objects outlive it.
+        """
+        import pandas as pd
+        from pandas.api.types import union_categoricals
+
+        text_columns = [c for c in ("Name", "Type", "Device") if c in columns]
+        chunks = []
+        for cursor in cursors:
+            while True:
+                rows = cursor.fetchmany(FRAME_FETCH_ROWS)
+                if not rows:
+                    break
+                chunk = pd.DataFrame.from_records(rows, columns=columns)
+                # Imported spreadsheets can leave these empty, NaN until the end
+                chunk["User ID"] = pd.to_numeric(chunk["User ID"], errors="coerce")
+                chunk["Status"] = pd.to_numeric(chunk["Status"], errors="coerce")
+                # Stored epochs are the device wall clock, the result stays naive like from_epoch
+                chunk["Time"] = pd.to_datetime(chunk["Time"], unit="s")
+                for column in text_columns:
+                    chunk[column] = chunk[column].astype("category")
+                chunks.append(chunk)
+        if not chunks:
+            chunks.append(pd.DataFrame({
+                "User ID": pd.Series(dtype="int64"),
+                "Name": pd.Categorical([]),
+                "Time": pd.Series(dtype="datetime64[s]"),
+                "Type": pd.Categorical([]),
+                "Status": pd.Series(dtype="int64"),
+                "Device": pd.Categorical([]),
+            }, columns=columns))
+
+        frame = pd.concat(chunks, ignore_index=True)
+        for column in text_columns:
+            # Chunks carry their own categories, concat alone would fall back to object
+            frame[column] = union_categoricals([chunk[column] for chunk in chunks])
+        for column in ("User ID", "Status"):
+            values = frame[column]
+            frame[column] = values.astype("Int64" if values.isna().any() else "int64")
+        return frame
+
+    def get_punches_frame(self, device, start_date=None, end_date=None):
+        # get_punches as a DataFrame, columns User ID, Name, Time, Type, Status
+        return self._punch_frame(
+            self._punch_cursors(device, start_date, end_date),
+            ["User ID", "Name", "Time", "Type", "Status"]
+        )
+
+    def get_export_records_frame(self, export_id):
+        # get_export_records as a DataFrame, with a Device column
+        def cursors():
+            for conn in self._punch_sources():
+                cursor = conn.execute('''
+                    SELECT p.user_id, p.name, p.timestamp, p.punch_type, p.status, p.device
+                    FROM export_punches e JOIN punches p ON p.id = e.punch_id
+                    WHERE e.export_id = ?
+                    ORDER BY p.timestamp
+                ''', (export_id,))
+                try:
+                    yield cursor
+                finally:
+                    cursor.close()
+
+        return self._punch_frame(cursors(), ["User ID", "Name", "Time", "Type", "Status", "Device"])
+
     def delete_export(self, export_id):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        # Enable FK support for cascade
-        cursor.execute("PRAGMA foreign_keys = ON")
-        cursor.execute("DELETE FROM export_logs WHERE id = ?", (export_id,))
-        conn.commit()
-        conn.close()
+        for file_name, _start, _end in self._archives():
+            conn = self._archive_connection(file_name)
+            conn.execute("DELETE FROM export_punches WHERE export_id = ?", (export_id,))
+        with self.transaction() as conn:
+            # foreign_keys is on for every connection, unlink explicitly anyway
+            # for databases whose export_punches predates the constraint
+            conn.execute("DELETE FROM export_punches WHERE export_id = ?", (export_id,))
+            conn.execute("DELETE FROM export_logs WHERE id = ?", (export_id,))
@@ -0,0 +1,84 @@
+"""
+Background writer for the local store. The GUI queues write jobs here
+instead of calling DatabaseManager on its own thread; the writer commits
+whatever has piled up as one transaction and reports each job back through
+Qt signals. Readers keep their per-thread connections and, with WAL, never
+wait on it.
+"""
+import itertools
+import logging
+import queue
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+# Most jobs committed together, a flood of jobs still commits regularly
+WRITER_BATCH_SIZE = 64
+
+
+class DatabaseWriter(QThread):
+    # (job id, return value) once the job's transaction is committed
+    job_finished = pyqtSignal(int, object)
+    job_failed = pyqtSignal(int, str)
+
+    def __init__(self, db_manager, batch_size=WRITER_BATCH_SIZE):
+        super().__init__()
+        self.db_manager = db_manager
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._job_ids = itertools.count(1)
+
+    def submit(self, func, *args, **kwargs):
+        # func(*args, **kwargs) runs on the writer thread, so db_manager calls
+        # inside it use the writer's connection. Returns the job id the
+        # signals carry.
+        job_id = next(self._job_ids)
+        self._queue.put((job_id, func, args, kwargs))
+        return job_id
+
+    def stop(self):
+        # Jobs queued before this are still written
+        self._queue.put(None)
+        self.wait()
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            jobs = [self._queue.get()]
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = None in jobs
+            jobs = [job for job in jobs if job is not None]
+
+            for job_id, ok, result in self._write(jobs):
+                if ok:
+                    self.job_finished.emit(job_id, result)
+                else:
+                    self.job_failed.emit(job_id, result)
+        self.db_manager.release_thread()
+
+    def _write(self, jobs):
+        # One commit for the batch, a savepoint per job so a failing job
+        # only undoes its own writes
+        results = []
+        try:
+            with self.db_manager.transaction() as conn:
+                for job_id, func, args, kwargs in jobs:
+                    conn.execute("SAVEPOINT writer_job")
+                    try:
+                        result = func(*args, **kwargs)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO writer_job")
+                        conn.execute("RELEASE writer_job")
+                        logging.error(f"Database write job {job_id} failed: {e}")
+                        results.append((job_id, False, str(e)))
+                    else:
+                        conn.execute("RELEASE writer_job")
+                        results.append((job_id, True, result))
+        except Exception as e:
+            # Nothing of the batch was committed
+            logging.error(f"Database write batch failed: {e}")
+            return [(job_id, False, str(e)) for job_id, _func, _args, _kwargs in jobs]
+        return results
@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from modules.zk_interaction_utils import ZKDeviceController
+import logging
+import time
+
+
+def harvest_device(device_config, start_date=None, end_date=None, session_manager=None):
+    if session_manager is not None:
+        def operation(controller):
+            # Lock the terminal per transfer only, unless the UI already holds it
+            short_lock = controller.short_lock
+            controller.short_lock = True
+            try:
+                return controller.retrieve_attendance_with_user_names(start_date, end_date)
+            finally:
+                controller.short_lock = short_lock
+        return session_manager.call(device_config, operation)
+
+    controller = ZKDeviceController(
+        ip_address=device_config["ip"],
+        port=device_config["port"],
+        timeout=device_config["timeout"],
+        password=device_config["password"],
+        ommit_ping=device_config.get("ommit_ping", False),
+    )
+    controller.short_lock = True
+    controller.create_zk_instance()
+    controller.connect_to_device()
+    try:
+        return controller.retrieve_attendance_with_user_names(start_date, end_date)
+    finally:
+        controller.disconnect_from_device()
+
+
+def harvest_all_devices(devices, start_date=None, end_date=None, max_workers=4, device_timeout=60, session_manager=None):
+    """
+    Pull attendance from every configured device in parallel.
+    Each device gets at most device_timeout seconds; a slow or unreachable
+    terminal is reported in errors without holding up the others.
+    With a session_manager, live sessions are reused instead of reconnecting.
+    Returns {"results": {name: records}, "errors": {name: message}, "records": merged}
+    """
+    results = {}
+    errors = {}
+    started = {}
+
+    def run(name, device_config):
+        started[name] = time.monotonic()
+        try:
+            return harvest_device(device_config, start_date, end_date, session_manager)
+        finally:
+            # Pool threads read the user cache through the session's controller
+            db_manager = getattr(session_manager, "db_manager", None)
+            if db_manager:
+                db_manager.release_thread()
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(devices))))
+    futures = {}
+    for index, device_config in enumerate(devices):
+        name = device_config.get("name") or f"Device {index + 1}"
+        if name in futures.values():
+            name = f"{name} ({device_config.get('ip')})"
+        futures[executor.submit(run, name, device_config)] = name
+
+    try:
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = futures[future]
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    errors[name] = str(e)
+                    logging.error(f"Harvest failed for {name}: {e}")
+
+            # The timeout runs from when a worker picked the device up,
+            # not from when it was queued
+            now = time.monotonic()
+            for future in list(pending):
+                name = futures[future]
+                if name in started and now - started[name] > device_timeout:
+                    pending.discard(future)
+                    errors[name] = f"Timed out after {device_timeout} seconds"
+                    logging.error(f"Harvest timed out for {name}")
+    finally:
+        # Do not block on hung sockets, they die with their own ZK timeout
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    merged = []
+    for name, records in results.items():
+        for record in records:
+            record["Device"] = name
+            merged.append(record)
+    merged.sort(key=lambda r: r["Time"])
+
+    return {"results": results, "errors": errors, "records": merged}
@@ -0,0 +1,228 @@
+from contextlib import contextmanager
+from modules.zk_interaction_utils import ZKDeviceController
+import threading
+import logging
+import time
+
+
+class DeviceSession:
+    def __init__(self, device_config, db_manager=None):
+        self.device_config = device_config
+        self.db_manager = db_manager
+        self.controller = None
+        # Re-entrant so a worker holding the session can call helpers that lock again
+        self.lock = threading.RLock()
+        self.last_used = 0.0
+
+    @property
+    def key(self):
+        return f"{self.device_config['ip']}:{self.device_config['port']}"
+
+    @property
+    def is_connected(self):
+        return self.controller is not None and self.controller.connection is not None
+
+    def _new_controller(self):
+        return ZKDeviceController(
+            ip_address=self.device_config["ip"],
+            port=self.device_config["port"],
+            timeout=self.device_config["timeout"],
+            password=self.device_config["password"],
+            db_manager=self.db_manager,
+            ommit_ping=self.device_config.get("ommit_ping", False),
+        )
+
+    def connect(self):
+        # Reconnects reuse the controller, so references held by the UI and
+        # its in-memory caches stay valid
+        controller = self.controller or self._new_controller()
+        controller.create_zk_instance()
+        controller.connect_to_device()
+        self.controller = controller
+        self.last_used = time.monotonic()
+
+    def connect_with_backoff(self, max_retries=3, backoff_base=1.0, backoff_max=30.0):
+        self._with_backoff(self.connect, max_retries, backoff_base, backoff_max)
+
+    def open_connection(self, max_retries=3, backoff_base=1.0, backoff_max=30.0):
+        """
+        Connect a controller of its own, with backoff. Nothing of the session
+        is touched, so this runs without the lock; adopt() moves the
+        connection over.
+        """
+        controller = self._new_controller()
+
+        def connect():
+            controller.create_zk_instance()
+            controller.connect_to_device()
+
+        self._with_backoff(connect, max_retries, backoff_base, backoff_max)
+        return controller
+
+    def adopt(self, controller):
+        # Called under the lock with a controller from open_connection
+        self.controller.zk, self.controller.connection = controller.zk, controller.connection
+        self.last_used = time.monotonic()
+
+    def _with_backoff(self, connect, max_retries, backoff_base, backoff_max):
+        last_error = None
+        for attempt in range(max_retries):
+            try:
+                connect()
+                return
+            except ValueError as e:
+                last_error = e
+                if attempt < max_retries - 1:
+                    delay = min(backoff_max, backoff_base * (2 ** attempt))
+                    logging.warning(f"Reconnect to {self.key} failed, retrying in {delay:.1f}s: {e}")
+                    time.sleep(delay)
+        raise ValueError(f"Could not reconnect to {self.key} after {max_retries} attempts: {last_error}")
+
+    def mark_dead(self):
+        # Drop the socket without talking to the device, it is already gone
+        if self.controller is not None:
+            try:
+                self.controller.connection.disconnect()
+            except Exception:
+                pass
+            self.controller.connection = None
+
+    def close(self):
+        if self.is_connected:
+            try:
+                self.controller.disconnect_from_device()
+            except ValueError as e:
+                logging.error(f"Error closing session {self.key}: {e}")
+        self.controller = None
+
+
+class DeviceSessionManager:
+    """
+    Keeps one live connection per device so repeated operations skip the
+    TCP handshake and auth. Sessions are pinged while idle and reconnected
+    with exponential backoff when they drop.
+    """
+
+    def __init__(self, keepalive_interval=30, max_retries=3, backoff_base=1.0, backoff_max=30.0, db_manager=None):
+        self.db_manager = db_manager
+        self.keepalive_interval = keepalive_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sessions = {}
+        self._sessions_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._keepalive_thread = None
+
+    def get_session(self, device_config):
+        key = f"{device_config['ip']}:{device_config['port']}"
+        with self._sessions_lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = DeviceSession(device_config, self.db_manager)
+                self.sessions[key] = session
+            else:
+                session.device_config = device_config
+        self._start_keepalive()
+        return session
+
+    def _ensure_connected(self, session):
+        if not session.is_connected:
+            session.connect_with_backoff(self.max_retries, self.backoff_base, self.backoff_max)
+
+    @contextmanager
+    def session(self, device_config):
+        """Hand out a connected controller, held exclusively for the block."""
+        session = self.get_session(device_config)
+        with session.lock:
+            self._ensure_connected(session)
+            try:
+                yield session.controller
+            finally:
+                session.last_used = time.monotonic()
+
+    def call(self, device_config, operation):
+        """
+        Run operation(controller) on the device's session. If it fails, the
+        session is reconnected and the operation retried once.
+        """
+        session = self.get_session(device_config)
+        with session.lock:
+            self._ensure_connected(session)
+            try:
+                return operation(session.controller)
+            except ValueError as e:
+                logging.warning(f"Operation on {session.key} failed, reconnecting: {e}")
+                session.mark_dead()
+                self._ensure_connected(session)
+                return operation(session.controller)
+            finally:
+                session.last_used = time.monotonic()
+
+    def close(self, device_config):
+        key = f"{device_config['ip']}:{device_config['port']}"
+        with self._sessions_lock:
+            session = self.sessions.pop(key, None)
+        if session is not None:
+            with session.lock:
+                session.close()
+
+    def close_all(self):
+        self._stop.set()
+        with self._sessions_lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            with session.lock:
+                session.close()
+
+    def _start_keepalive(self):
+        if self.keepalive_interval and (self._keepalive_thread is None or not self._keepalive_thread.is_alive()):
+            self._stop.clear()
+            self._keepalive_thread = threading.Thread(target=self._keepalive_loop, daemon=True)
+            self._keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        while not self._stop.wait(self.keepalive_interval):
+            with self._sessions_lock:
+                sessions = list(self.sessions.values())
+            for session in sessions:
+                self._keepalive(session)
+
+    def _keepalive(self, session):
+        # Skip sessions a worker is using, they are alive by definition
+        if not session.lock.acquire(blocking=False):
+            return
+        try:
+            if session.controller is None:
+                return
+            if time.monotonic() - session.last_used < self.keepalive_interval:
+                return
+            if session.is_connected:
+                try:
+                    # Smallest request the device answers, no log transfer
+                    session.controller.connection.read_sizes()
+                    session.last_used = time.monotonic()
+                    return
+                except Exception as e:
+                    logging.warning(f"Keepalive to {session.key} failed: {e}")
+                    session.mark_dead()
+        finally:
+            session.lock.release()
+
+        # Handshake and backoff sleeps happen without the lock, the window
+        # and workers are not held up while a dead device times out
+        try:
+            controller = session.open_connection(self.max_retries, self.backoff_base, self.backoff_max)
+        except ValueError as e:
+            logging.error(str(e))
+            return
+        with session.lock:
+            # Closed meanwhile, or a caller already reconnected it
+            if session.controller is None or session.is_connected:
+                try:
+                    controller.connection.disconnect()
+                except Exception:
+                    pass
+                return
+            session.adopt(controller)
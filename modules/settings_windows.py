@@ -15,6 +15,7 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtGui import QColor, QIcon
 from PyQt5.QtCore import Qt
+from modules.data_converter import FILE_WRITERS
 import json
 import os
 
@@ -197,7 +198,14 @@ class SettingsWindow(QDialog):
     def save_settings(self):
         try:
             # Update General Settings
-            self.settings['file_format'] = self.file_format_edit.text()
+            file_format = self.file_format_edit.text().strip().lower()
+            if file_format not in FILE_WRITERS:
+                QMessageBox.warning(
+                    self, "File Format",
+                    f"Unknown file format '{file_format}'. Use one of: {', '.join(FILE_WRITERS)}."
+                )
+                return
+            self.settings['file_format'] = file_format
             self.settings['export_path'] = self.export_path_edit.text()
 
             with open('settings.json', 'w') as file:
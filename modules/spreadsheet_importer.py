@@ -0,0 +1,150 @@
+"""
+Bulk import of attendance_*.xlsx files written by DataConverter into the
+local store. Each file becomes an export history session; punches already
+stored are linked, not duplicated. Workbooks are streamed in openpyxl
+read-only mode, so file size does not matter.
+"""
+from datetime import datetime
+import logging
+import glob
+import re
+import os
+
+from modules.database import to_epoch
+
+# Header spellings of the layouts DataConverter has written, raw pyzk
+# records were exported as id/timestamp/punch
+COLUMN_ALIASES = {
+    "User ID": "User ID",
+    "id": "User ID",
+    "Name": "Name",
+    "Time": "Time",
+    "timestamp": "Time",
+    "Type": "Type",
+    "punch": "Type",
+    "Status": "Status",
+}
+
+# Rows handed to the database per call, each call is its own short
+# transaction so live capture and syncs can write in between
+IMPORT_BATCH_SIZE = 5000
+
+
+def find_attendance_files(paths):
+    # Files as given, directories searched for attendance_*.xlsx; the
+    # timestamped names sort oldest first
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(glob.glob(os.path.join(path, "attendance_*.xlsx")))
+        elif os.path.isfile(path):
+            files.add(path)
+        else:
+            raise ValueError(f"No such file or directory: {path}")
+    return sorted((os.path.abspath(f) for f in files), key=os.path.basename)
+
+
+def export_time(file_path):
+    # When the file was exported, from its name or else its mtime
+    # Exports in the same second are named attendance_<time>_2.xlsx, _3, ...
+    name = re.sub(r"_\d+(\.xlsx)$", r"\1", os.path.basename(file_path))
+    try:
+        return datetime.strptime(name, "attendance_%Y-%m-%d_%H-%M-%S.xlsx")
+    except ValueError:
+        return datetime.fromtimestamp(os.path.getmtime(file_path))
+
+
+def iter_workbook_batches(file_path, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Attendance dicts from every sheet of an export, batch_size at a time.
+    Rows without a user id or a readable time are skipped.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        batch = []
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            columns = [COLUMN_ALIASES.get(str(h).strip()) if h is not None else None for h in header]
+            if "User ID" not in columns or "Time" not in columns:
+                raise ValueError(f"{os.path.basename(file_path)} is not an attendance export")
+
+            for row in rows:
+                record = {key: value for key, value in zip(columns, row) if key}
+                # A punch is keyed by (device, user_id, timestamp), without both it can
+                # neither be deduplicated nor linked to the session
+                if isinstance(record.get("User ID"), str):
+                    record["User ID"] = record["User ID"].strip()
+                if record.get("User ID") in (None, "") or to_epoch(record.get("Time")) is None:
+                    continue
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+    finally:
+        workbook.close()
+
+
+def import_attendance_files(db_manager, paths, device, device_name=None, progress=None):
+    """
+    Import export workbooks for one device (store key, "ip:port") as
+    history sessions. Files already in the history are skipped.
+    progress(done_files, total_files, file_path, rows_read) is called as
+    work advances. Returns {"files", "skipped", "failed", "records", "new"}.
+    """
+    files = find_attendance_files(paths)
+    # Sessions left at record_count 0 by an import that never finished are redone
+    known = {}
+    for row in db_manager.get_export_history():
+        if row[5]:
+            known[os.path.abspath(row[5])] = row[0] if not row[2] else None
+    summary = {"files": 0, "skipped": 0, "failed": {}, "records": 0, "new": 0}
+
+    for index, file_path in enumerate(files):
+        if file_path in known and known[file_path] is None:
+            summary["skipped"] += 1
+            if progress:
+                progress(index + 1, len(files), file_path, 0)
+            continue
+
+        if file_path in known:
+            db_manager.delete_export(known[file_path])
+
+        export_id = None
+        try:
+            # Each batch commits on its own so the write lock is never held for a
+            # whole workbook; the session only gets its count once every batch is in
+            export_id = db_manager.log_export(
+                device_name or device, 0, file_path, timestamp=export_time(file_path)
+            )
+            count = new = 0
+            first = last = None
+            for batch in iter_workbook_batches(file_path):
+                new += db_manager.save_export_records(export_id, batch, device)
+                count += len(batch)
+                times = [to_epoch(r["Time"]) for r in batch]
+                first = min(times + ([first] if first is not None else []))
+                last = max(times + ([last] if last is not None else []))
+                if progress:
+                    progress(index, len(files), file_path, count)
+            db_manager.update_export(export_id, count, first, last)
+        except Exception as e:
+            # Batches already committed stay as punches, the session and its links go
+            if export_id is not None:
+                db_manager.delete_export(export_id)
+            logging.error(f"Import of {file_path} failed: {e}")
+            summary["failed"][file_path] = str(e)
+            continue
+
+        summary["files"] += 1
+        summary["records"] += count
+        summary["new"] += new
+        if progress:
+            progress(index + 1, len(files), file_path, count)
+    return summary
@@ -1,10 +1,110 @@
-from zk import ZK, const
+from struct import unpack_from
+from datetime import datetime
+from contextlib import contextmanager
 import logging
+import time
 import hashlib
 import re
 
+PUNCH_TYPE_MAP = {
+    0: "Check-In",
+    1: "Check-Out",
+    2: "Break-Out",
+    3: "Break-In",
+    4: "Overtime-In",
+    5: "Overtime-Out"
+}
+
+
+def decode_zk_time(t):
+    # Same formula as pyzk's private ZK.__decode_time (zkemsdk.c DecodeTime)
+    second = t % 60
+    t = t // 60
+    minute = t % 60
+    t = t // 60
+    hour = t % 24
+    t = t // 24
+    day = t % 31 + 1
+    t = t // 31
+    month = t % 12 + 1
+    t = t // 12
+    return datetime(t + 2000, month, day, hour, minute, second)
+
+
+# Raw attendance record layouts by record size, as read by iter_attendance_batches
+ATTENDANCE_DTYPES = {
+    8: [("uid", "<u2"), ("status", "u1"), ("timestamp", "<u4"), ("punch", "u1")],
+    16: [("user_id", "<u4"), ("timestamp", "<u4"), ("status", "u1"), ("punch", "u1"), ("reserved", "V6")],
+    40: [("uid", "<u2"), ("user_id", "S24"), ("status", "u1"), ("timestamp", "<u4"), ("punch", "u1"),
+         ("reserved", "V8")],
+}
+
+
+def decode_attendance_frame(data, step, user_map, uid_map=None, start_date=None, end_date=None):
+    """
+    DataFrame (User ID, Name, Time, Type, Status) straight from a raw
+    attendance buffer, the same records merge_user_names builds. Times are
+    decoded and filtered as arrays; user ids, names and punch types are
+    resolved once per distinct value and spread back with categorical
+    codes. "User ID" is int64 when every id is numeric, else a categorical.
+    """
+    import numpy as np
+    import pandas as pd
+
+    records = np.frombuffer(data, dtype=ATTENDANCE_DTYPES[step], count=len(data) // step)
+
+    # decode_zk_time over the whole column: month start plus days and seconds
+    t = records["timestamp"].astype("int64")
+    seconds = t % 86400
+    t = t // 86400
+    day = t % 31
+    t = t // 31
+    month = t % 12
+    year = t // 12
+    times = (
+        ((year + 30) * 12 + month).astype("datetime64[M]").astype("datetime64[s]")
+        + day.astype("timedelta64[D]") + seconds.astype("timedelta64[s]")
+    )
+
+    if start_date and end_date:
+        keep = (times >= np.datetime64(start_date, "s")) & (times <= np.datetime64(end_date, "s"))
+        records, times = records[keep], times[keep]
+
+    # Device user ids as the user map keys them (strings)
+    if step == 8:
+        uids, user_codes = np.unique(records["uid"], return_inverse=True)
+        user_ids = [uid_map.get(int(uid), str(uid)) for uid in uids]
+    elif step == 16:
+        raw_ids, user_codes = np.unique(records["user_id"], return_inverse=True)
+        user_ids = [str(user_id) for user_id in raw_ids]
+    else:
+        raw_ids, user_codes = np.unique(records["user_id"], return_inverse=True)
+        user_ids = [bytes(user_id).split(b'\x00')[0].decode(errors='ignore') for user_id in raw_ids]
+
+    if all(user_id.isdigit() for user_id in user_ids):
+        user_column = np.array([int(user_id) for user_id in user_ids], dtype="int64")[user_codes]
+    else:
+        user_column = pd.Categorical(np.array(user_ids, dtype=object)[user_codes])
+
+    # Names can repeat across users, categories cannot
+    name_codes = {}
+    codes = [name_codes.setdefault(user_map.get(user_id, "Unknown"), len(name_codes)) for user_id in user_ids]
+    names = pd.Categorical.from_codes(np.array(codes, dtype="int64")[user_codes], list(name_codes))
+
+    punch_labels = [PUNCH_TYPE_MAP.get(punch, str(punch)) for punch in range(256)]
+    types = pd.Categorical.from_codes(records["punch"], punch_labels).remove_unused_categories()
+
+    return pd.DataFrame({
+        "User ID": user_column,
+        "Name": names,
+        "Time": times,
+        "Type": types,
+        "Status": records["status"].astype("int64"),
+    })
+
+
 class ZKDeviceController:
-    def __init__(self, ip_address: str, port: int, timeout: int, password: str):
+    def __init__(self, ip_address: str, port: int, timeout: int, password: str, db_manager=None, ommit_ping=False):
         if not re.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$', ip_address):
             raise ValueError("Invalid IP address format")
         if not isinstance(port, int):
@@ -17,10 +117,25 @@ class ZKDeviceController:
         self.timeout = timeout
         self.password = hashlib.sha256(password.encode()).hexdigest()
         self.zk = None
+        # pyzk pings before connecting, hosts without a ping binary need to skip it
+        self.ommit_ping = ommit_ping
+        # Optional DatabaseManager backing the user directory cache
+        self.db_manager = db_manager
+        self._user_map = None
+        self._user_sizes = None
+        self._uid_map = None
+        # When True the terminal is only disabled for the span of each
+        # transfer instead of for the whole session
+        self.short_lock = False
+        self.lockout_log = []
+        self._disabled_at = None
 
     def create_zk_instance(self):
+        # pyzk is only needed once we actually talk to a device
+        from zk import ZK
+
         try:
-            self.zk = ZK(self.ip_address, self.port, self.timeout, 0, force_udp=False, ommit_ping=False)
+            self.zk = ZK(self.ip_address, self.port, self.timeout, 0, force_udp=False, ommit_ping=self.ommit_ping)
         except Exception as e:
             error_msg = f"Failed to initialize ZK: {e}"
             logging.error(error_msg)
@@ -43,15 +158,50 @@ class ZKDeviceController:
     def disable_device(self):
         if self.connection:
             self.connection.disable_device()
+            if self._disabled_at is None:
+                self._disabled_at = time.monotonic()
         else:
             raise ValueError("Invalid Connection")
 
     def enable_device(self):
         if self.connection:
             self.connection.enable_device()
+            if self._disabled_at is not None:
+                self._record_lockout("session", time.monotonic() - self._disabled_at)
+                self._disabled_at = None
         else:
             raise ValueError("Invalid Connection")
 
+    def _record_lockout(self, operation, seconds):
+        self.lockout_log.append({
+            "operation": operation,
+            "seconds": seconds,
+            "at": datetime.now()
+        })
+        logging.info(f"Device {self.device_key} locked for {seconds:.2f}s ({operation})")
+
+    @contextmanager
+    def transfer_lock(self, operation):
+        """
+        In short_lock mode, disable the terminal only while `operation`
+        transfers data and re-enable it right after. No-op otherwise, or
+        when the device is already held disabled for the session.
+        """
+        if not self.short_lock or self._disabled_at is not None:
+            yield
+            return
+        self.connection.disable_device()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.connection.enable_device()
+            self._record_lockout(operation, time.monotonic() - started)
+
+    @property
+    def last_lockout(self):
+        return self.lockout_log[-1] if self.lockout_log else None
+
     def disconnect_from_device(self):
         try:
             if self.connection:
@@ -68,7 +218,8 @@ class ZKDeviceController:
     def retrieve_attendance_data(self, start_date=None, end_date=None):
         try:
             if self.connection:
-                attendances = self.connection.get_attendance()
+                with self.transfer_lock("get_attendance"):
+                    attendances = self.connection.get_attendance()
                 if len(attendances) == 0:
                     logging.warning("No attendance data found")
                 
@@ -90,7 +241,8 @@ class ZKDeviceController:
     def retrieve_users_data(self):
         try:
             if self.connection:
-                users = self.connection.get_users()
+                with self.transfer_lock("get_users"):
+                    users = self.connection.get_users()
                 if len(users) == 0:
                     logging.warning("No users data found")
                 return users
@@ -103,43 +255,282 @@ class ZKDeviceController:
 
     def retrieve_attendance_with_user_names(self, start_date=None, end_date=None):
         try:
-            # 1. Get Users Map
-            users = self.retrieve_users_data()
-            user_map = {u.user_id: u.name for u in users}
-            
-            # 2. Get Attendance
-            attendance = self.retrieve_attendance_data(start_date, end_date)
-            
-            # 3. Merge
+            # 1. Get Users Map, from the cache while the device's user table is unchanged
+            user_map = self.get_user_map()
+
+            # 2. Get Attendance, decoded from the raw log; pyzk's get_attendance()
+            # would download the user table again on every call
             merged_data = []
-            
-            punch_type_map = {
-                0: "Check-In",
-                1: "Check-Out",
-                2: "Break-Out",
-                3: "Break-In",
-                4: "Overtime-In",
-                5: "Overtime-Out"
-            }
-            
-            for att in attendance:
-                name = user_map.get(att.user_id, "Unknown")
-                punch_str = punch_type_map.get(att.punch, str(att.punch))
-                
-                merged_data.append({
-                    "User ID": att.user_id,
-                    "Name": name,
-                    "Time": att.timestamp,
-                    "Type": punch_str,
-                    "Status": att.status
-                })
+            for batch in self.iter_attendance_batches():
+                if start_date and end_date:
+                    batch = [att for att in batch if start_date <= att.timestamp <= end_date]
+
+                # 3. Merge
+                merged_data.extend(self.merge_user_names(batch, user_map))
             return merged_data
+
+        except Exception as e:
+            error_msg = f"Error retrieving merged data: {e}"
+            logging.error(error_msg)
+            raise ValueError(error_msg)
+
+    def merge_user_names(self, attendance, user_map):
+        merged_data = []
+        
+        for att in attendance:
+            name = user_map.get(att.user_id, "Unknown")
+            punch_str = PUNCH_TYPE_MAP.get(att.punch, str(att.punch))
             
+            merged_data.append({
+                "User ID": att.user_id,
+                "Name": name,
+                "Time": att.timestamp,
+                "Type": punch_str,
+                "Status": att.status
+            })
+        return merged_data
+
+    def _read_attendance_buffer(self):
+        """
+        The raw attendance log as (memoryview of the records, record size),
+        or None when the device has no punches. Old firmware stores 8-byte
+        records with the internal uid, then self._uid_map is loaded too.
+        """
+        if not self.connection:
+            raise ValueError("Invalid Connection")
+
+        self.connection.read_sizes()
+        records = self.connection.records
+        if records == 0:
+            logging.warning("No attendance data found")
+            return None
+
+        from zk import const
+
+        # Only the transfer needs the lock, decoding happens after
+        with self.transfer_lock("get_attendance"):
+            data, size = self.connection.read_with_buffer(const.CMD_ATTLOG_RRQ)
+        if size < 4:
+            logging.warning("No attendance data found")
+            return None
+
+        total_size = unpack_from("<I", data, 0)[0]
+        record_size = total_size / records
+        if record_size == 8:
+            if self._uid_map is None:
+                self.get_user_map(refresh=True)
+            step = 8
+        elif record_size == 16:
+            step = 16
+        else:
+            step = 40
+        return memoryview(data)[4:], step
+
+    def batch_user_names(self, attendance, user_map, previous=None):
+        # merge_user_names into an AttendanceBatch, no dict per punch; previous,
+        # an earlier batch of the same stream, lends its tables of distinct values
+        from modules.attendance_batch import AttendanceBatch
+
+        batch = previous.sibling() if previous is not None else AttendanceBatch()
+        for att in attendance:
+            batch.append(
+                att.user_id,
+                user_map.get(att.user_id, "Unknown"),
+                att.timestamp,
+                PUNCH_TYPE_MAP.get(att.punch, str(att.punch)),
+                att.status
+            )
+        return batch
+
+    def iter_attendance_batches(self, batch_size=5000):
+        """
+        Yield the device log as lists of Attendance, decoded batch_size at a
+        time from the raw buffer instead of pyzk's whole-log list.
+        """
+        try:
+            buffer = self._read_attendance_buffer()
+            if buffer is None:
+                return
+            data, step = buffer
+
+            from zk.attendance import Attendance
+
+            uid_map = self._uid_map
+            batch = []
+            for offset in range(0, len(data) - step + 1, step):
+                if step == 8:
+                    uid, status, timestamp, punch = unpack_from("<HBIB", data, offset)
+                    user_id = uid_map.get(uid, str(uid))
+                elif step == 16:
+                    user_id, timestamp, status, punch = unpack_from("<IIBB", data, offset)
+                    uid = user_id
+                    user_id = str(user_id)
+                else:
+                    uid, user_id, status, timestamp, punch = unpack_from("<H24sBIB", data, offset)
+                    user_id = bytes(user_id).split(b'\x00')[0].decode(errors='ignore')
+
+                batch.append(Attendance(user_id, decode_zk_time(timestamp), status, punch, uid))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        except Exception as e:
+            error_msg = f"Error retrieving attendance data: {e}"
+            logging.error(error_msg)
+            raise ValueError(error_msg)
+
+    def retrieve_attendance_frame(self, start_date=None, end_date=None):
+        # Columnar counterpart of retrieve_attendance_with_user_names, see decode_attendance_frame
+        try:
+            user_map = self.get_user_map()
+            buffer = self._read_attendance_buffer()
+            data, step = buffer if buffer is not None else (b"", 40)
+            return decode_attendance_frame(data, step, user_map, self._uid_map, start_date, end_date)
         except Exception as e:
             error_msg = f"Error retrieving merged data: {e}"
             logging.error(error_msg)
             raise ValueError(error_msg)
 
+    def iter_attendance_with_user_names(self, start_date=None, end_date=None, batch_size=5000):
+        """Streaming counterpart of retrieve_attendance_with_user_names, yields AttendanceBatches."""
+        user_map = self.get_user_map()
+        previous = None
+        for batch in self.iter_attendance_batches(batch_size):
+            if start_date and end_date:
+                batch = [att for att in batch if start_date <= att.timestamp <= end_date]
+            if batch:
+                previous = self.batch_user_names(batch, user_map, previous)
+                yield previous
+
+    def capture_live_punches(self, db_manager, timeout=10):
+        """
+        Yield punches as the device reports them, storing each one in the
+        local punch store first. Yields None every `timeout` seconds without
+        events so the caller can check whether to stop.
+        Needs a connection of its own, the socket is busy until stopped.
+        """
+        try:
+            if not self.connection:
+                raise ValueError("Invalid Connection")
+
+            user_map = self.get_user_map()
+            for att in self.connection.live_capture(new_timeout=timeout):
+                if att is None:
+                    yield None
+                    continue
+                record = self.merge_user_names([att], user_map)[0]
+                db_manager.save_punches(self.device_key, [record])
+                yield record
+
+        except Exception as e:
+            error_msg = f"Error during live capture: {e}"
+            logging.error(error_msg)
+            raise ValueError(error_msg)
+
+    def stop_live_capture(self):
+        if self.connection:
+            self.connection.end_live_capture = True
+
+    def get_user_map(self, refresh=False):
+        """
+        user_id -> name for the device, served from memory or SQLite while the
+        user and fingerprint counts from read_sizes are unchanged.
+        """
+        try:
+            if not self.connection:
+                raise ValueError("Invalid Connection")
+
+            self.connection.read_sizes()
+            sizes = (self.connection.users, self.connection.fingers)
+
+            if not refresh:
+                if self._user_map is not None and self._user_sizes == sizes:
+                    return self._user_map
+                if self.db_manager:
+                    cached_sizes, user_map = self.db_manager.get_cached_users(self.device_key)
+                    if cached_sizes == sizes:
+                        self._user_map, self._user_sizes = user_map, sizes
+                        return user_map
+
+            users = self.retrieve_users_data()
+            self.update_user_cache(users, sizes)
+            return self._user_map
+
+        except Exception as e:
+            error_msg = f"Error loading user directory: {e}"
+            logging.error(error_msg)
+            raise ValueError(error_msg)
+
+    def update_user_cache(self, users, sizes=None, store=True):
+        # store False only refreshes the in-memory maps, save_user_cache writes them later
+        if sizes is None:
+            self.connection.read_sizes()
+            sizes = (self.connection.users, self.connection.fingers)
+        self._user_map = {u.user_id: u.name for u in users}
+        self._uid_map = {u.uid: u.user_id for u in users}
+        self._user_sizes = sizes
+        if store:
+            self.save_user_cache()
+
+    def save_user_cache(self):
+        if self.db_manager and self._user_map is not None:
+            users, fingers = self._user_sizes
+            self.db_manager.save_cached_users(self.device_key, self._user_map, users, fingers)
+
+    @property
+    def device_key(self):
+        return f"{self.ip_address}:{self.port}"
+
+    def sync_attendance(self, db_manager):
+        """
+        Incrementally mirror the device log into the local punch store.
+        Only punches newer than the stored high-water mark are saved; a full
+        pull happens when the device log shrank or was cleared.
+        Returns the number of new punches stored.
+        """
+        try:
+            if not self.connection:
+                raise ValueError("Invalid Connection")
+
+            last_timestamp, last_count = db_manager.get_sync_state(self.device_key)
+
+            # read_sizes is a single small packet, the log itself is not sent
+            self.connection.read_sizes()
+            record_count = self.connection.records
+
+            if record_count < last_count or (record_count == 0 and last_count):
+                logging.warning(f"Device log on {self.device_key} shrank ({last_count} -> {record_count}), doing a full pull")
+                db_manager.reset_sync_state(self.device_key)
+                last_timestamp, last_count = None, 0
+
+            if record_count == last_count and last_timestamp:
+                return 0
+
+            high_water = None
+
+            inserted = 0
+            user_map = self.get_user_map()
+            for batch in self.iter_attendance_batches():
+                if last_timestamp:
+                    # Punches sharing the last second are deduplicated by the store
+                    batch = [att for att in batch if str(att.timestamp) >= last_timestamp]
+                if not batch:
+                    continue
+                inserted += db_manager.save_punches(self.device_key, self.batch_user_names(batch, user_map))
+                newest = max(str(att.timestamp) for att in batch)
+                if newest > (high_water or ""):
+                    high_water = newest
+
+            db_manager.update_sync_state(self.device_key, high_water or last_timestamp, record_count)
+            return inserted
+
+        except Exception as e:
+            error_msg = f"Error syncing attendance data: {e}"
+            logging.error(error_msg)
+            raise ValueError(error_msg)
+
     def is_device_enabled(self):
         try:
             if self.connection.is_enabled:
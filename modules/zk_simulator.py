@@ -0,0 +1,335 @@
+#!/usr/bin/python3
+"""
+Local stand-in for a ZK terminal, for benchmarking without hardware.
+
+Speaks enough of the ZK TCP and UDP protocol for pyzk's connect,
+read_sizes, get_users, get_attendance, disable_device, enable_device and
+disconnect, serving synthetic users and punches. Latency and packet loss
+can be injected.
+
+    python -m modules.zk_simulator --users 3000 --punches 80000 --port 4370
+"""
+from datetime import datetime, timedelta
+from struct import pack, unpack
+import socketserver
+import threading
+import argparse
+import logging
+import random
+import time
+
+CMD_USERTEMP_RRQ = 9
+CMD_ATTLOG_RRQ = 13
+CMD_GET_FREE_SIZES = 50
+CMD_CONNECT = 1000
+CMD_EXIT = 1001
+CMD_ENABLEDEVICE = 1002
+CMD_DISABLEDEVICE = 1003
+CMD_PREPARE_DATA = 1500
+CMD_DATA = 1501
+CMD_FREE_DATA = 1502
+CMD_PREPARE_BUFFER = 1503
+CMD_READ_BUFFER = 1504
+CMD_ACK_OK = 2000
+CMD_ACK_ERROR = 2001
+CMD_ACK_UNKNOWN = 0xffff
+
+MACHINE_PREPARE_DATA_1 = 20560
+MACHINE_PREPARE_DATA_2 = 32130
+USHRT_MAX = 65535
+
+# UDP data packets carry at most this much payload
+UDP_PACKET_DATA = 1024
+# Retransmission delay used to model a lost TCP segment
+TCP_RETRANSMIT_DELAY = 0.2
+
+
+def encode_zk_time(t):
+    # zkemsdk.c EncodeTime, inverse of decode_zk_time
+    return (
+        ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) *
+        (24 * 60 * 60) + (t.hour * 60 + t.minute) * 60 + t.second
+    )
+
+
+def checksum(packet):
+    # Same algorithm as the terminal firmware (zkemsdk.c)
+    if len(packet) % 2:
+        packet += b'\x00'
+    total = 0
+    for (word,) in (unpack('<H', packet[i:i + 2]) for i in range(0, len(packet), 2)):
+        total += word
+        if total > USHRT_MAX:
+            total -= USHRT_MAX
+    total = ~total
+    while total < 0:
+        total += USHRT_MAX
+    return total
+
+
+def build_packet(command, session_id, reply_id, payload=b''):
+    header = pack('<4H', command, 0, session_id, reply_id) + payload
+    return pack('<4H', command, checksum(header), session_id, reply_id) + payload
+
+
+class SyntheticDevice:
+    """Users and punches served by the simulator, generated deterministically."""
+
+    def __init__(self, users=100, punches=1000, start=None, seed=0):
+        rng = random.Random(seed)
+        start = start or datetime(2024, 1, 1, 8, 0, 0)
+
+        self.users = [(uid, str(1000 + uid), f"User {uid}") for uid in range(1, users + 1)]
+
+        # Punches are time ordered, as on a real terminal
+        records = []
+        timestamp = start
+        for _ in range(punches):
+            timestamp += timedelta(seconds=rng.randint(1, 120))
+            uid, user_id, _name = self.users[rng.randrange(users)] if users else (0, "0", "")
+            records.append((uid, user_id, 1, encode_zk_time(timestamp), rng.randint(0, 5)))
+        self.punches = records
+        self._user_buffer = None
+        self._attendance_buffer = None
+
+    def sizes_payload(self):
+        fields = [0] * 20
+        fields[4] = len(self.users)
+        fields[6] = 0
+        fields[8] = len(self.punches)
+        fields[14] = 10000
+        fields[15] = 10000
+        fields[16] = 500000
+        fields[17] = fields[14]
+        fields[18] = fields[15] - len(self.users)
+        fields[19] = fields[16] - len(self.punches)
+        return pack('20i', *fields) + pack('3i', 0, 0, 0)
+
+    def user_buffer(self):
+        # 72-byte ZK8 user records, what pyzk expects over TCP
+        if self._user_buffer is None:
+            body = b''.join(
+                pack('<HB8s24sIx7sx24s', uid, 0, b'', name.encode(), 0, b'1', user_id.encode())
+                for uid, user_id, name in self.users
+            )
+            self._user_buffer = pack('<I', len(body)) + body
+        return self._user_buffer
+
+    def attendance_buffer(self):
+        # 40-byte attendance records
+        if self._attendance_buffer is None:
+            body = b''.join(
+                pack('<H24sBIB8s', uid, user_id.encode(), status, timestamp, punch, b'')
+                for uid, user_id, status, timestamp, punch in self.punches
+            )
+            self._attendance_buffer = pack('<I', len(body)) + body
+        return self._attendance_buffer
+
+
+class SimulatorSession:
+    def __init__(self, device, session_id):
+        self.device = device
+        self.session_id = session_id
+        self.enabled = True
+        self.buffer = b''
+
+    def handle(self, command, payload):
+        """Return a list of (command, payload) responses."""
+        if command == CMD_CONNECT:
+            return [(CMD_ACK_OK, b'')]
+        if command in (CMD_EXIT, CMD_FREE_DATA):
+            self.buffer = b''
+            return [(CMD_ACK_OK, b'')]
+        if command == CMD_ENABLEDEVICE:
+            self.enabled = True
+            return [(CMD_ACK_OK, b'')]
+        if command == CMD_DISABLEDEVICE:
+            self.enabled = False
+            return [(CMD_ACK_OK, b'')]
+        if command == CMD_GET_FREE_SIZES:
+            return [(CMD_ACK_OK, self.device.sizes_payload())]
+        if command == CMD_PREPARE_BUFFER:
+            _flag, buffered_command, _fct, _ext = unpack('<bhii', payload[:11])
+            if buffered_command == CMD_USERTEMP_RRQ:
+                self.buffer = self.device.user_buffer()
+            elif buffered_command == CMD_ATTLOG_RRQ:
+                self.buffer = self.device.attendance_buffer()
+            else:
+                return [(CMD_ACK_UNKNOWN, b'')]
+            return [(CMD_ACK_OK, pack('<BI', 0, len(self.buffer)))]
+        if command == CMD_READ_BUFFER:
+            start, size = unpack('<ii', payload[:8])
+            chunk = self.buffer[start:start + size]
+            return [
+                (CMD_PREPARE_DATA, pack('<II', len(chunk), 0)),
+                (CMD_DATA, chunk),
+                (CMD_ACK_OK, b''),
+            ]
+        return [(CMD_ACK_UNKNOWN, b'')]
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _UDPServer(socketserver.ThreadingUDPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class ZKSimulator:
+    """
+    Serves a SyntheticDevice over TCP (and UDP on the same port).
+    latency is added before every response in seconds; loss is the
+    probability a response is lost (dropped on UDP, delayed by a
+    retransmission on TCP).
+    """
+
+    def __init__(self, device=None, host='127.0.0.1', port=0, latency=0.0, loss=0.0, udp=True, seed=0):
+        self.device = device or SyntheticDevice()
+        self.latency = latency
+        self.loss = loss
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._next_session = 1
+        self._udp_sessions = {}
+        self.host = host
+
+        simulator = self
+
+        class TCPHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                simulator._serve_tcp(self.request)
+
+        class UDPHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                data, sock = self.request
+                simulator._serve_udp(data, sock, self.client_address)
+
+        self.tcp_server = _TCPServer((host, port), TCPHandler)
+        self.port = self.tcp_server.server_address[1]
+        self.udp_server = None
+        if udp:
+            self.udp_server = _UDPServer((host, self.port), UDPHandler)
+        self._threads = []
+
+    def start(self):
+        for server in (self.tcp_server, self.udp_server):
+            if server is not None:
+                thread = threading.Thread(target=server.serve_forever, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in (self.tcp_server, self.udp_server):
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _new_session(self):
+        with self._rng_lock:
+            session_id = self._next_session
+            self._next_session = self._next_session % (USHRT_MAX - 1) + 1
+        return SimulatorSession(self.device, session_id)
+
+    def _lost(self):
+        if not self.loss:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < self.loss
+
+    def _serve_tcp(self, sock):
+        session = None
+        pending = b''
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            pending += data
+            while len(pending) >= 16:
+                magic1, magic2, length = unpack('<HHI', pending[:8])
+                if (magic1, magic2) != (MACHINE_PREPARE_DATA_1, MACHINE_PREPARE_DATA_2):
+                    logging.warning("Simulator dropped a TCP stream with a bad header")
+                    return
+                if len(pending) < 8 + length:
+                    break
+                packet, pending = pending[8:8 + length], pending[8 + length:]
+                command, _checksum, _session_id, reply_id = unpack('<4H', packet[:8])
+                if session is None:
+                    session = self._new_session()
+
+                responses = session.handle(command, packet[8:])
+                if self.latency:
+                    time.sleep(self.latency)
+                if self._lost():
+                    time.sleep(TCP_RETRANSMIT_DELAY)
+                out = b''.join(
+                    pack('<HHI', MACHINE_PREPARE_DATA_1, MACHINE_PREPARE_DATA_2, 8 + len(body)) +
+                    build_packet(code, session.session_id, reply_id, body)
+                    for code, body in responses
+                )
+                sock.sendall(out)
+                if command == CMD_EXIT:
+                    return
+
+    def _serve_udp(self, data, sock, address):
+        if len(data) < 8:
+            return
+        command, _checksum, session_id, reply_id = unpack('<4H', data[:8])
+        session = self._udp_sessions.get(address)
+        if command == CMD_CONNECT or session is None:
+            session = self._new_session()
+            self._udp_sessions[address] = session
+
+        responses = session.handle(command, data[8:])
+        if command == CMD_EXIT:
+            self._udp_sessions.pop(address, None)
+        if self.latency:
+            time.sleep(self.latency)
+
+        for code, body in responses:
+            # Large data goes out as a train of CMD_DATA datagrams
+            if code == CMD_DATA:
+                bodies = [body[i:i + UDP_PACKET_DATA] for i in range(0, len(body), UDP_PACKET_DATA)] or [b'']
+            else:
+                bodies = [body]
+            for part in bodies:
+                if self._lost():
+                    continue
+                sock.sendto(build_packet(code, session.session_id, reply_id, part), address)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a synthetic ZK terminal")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4370)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--punches", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added before every response")
+    parser.add_argument("--loss", type=float, default=0.0, help="Probability a response is lost")
+    args = parser.parse_args(argv)
+
+    device = SyntheticDevice(users=args.users, punches=args.punches)
+    simulator = ZKSimulator(device, host=args.host, port=args.port, latency=args.latency, loss=args.loss)
+    print(f"ZK simulator on {args.host}:{simulator.port} with {args.users} users and {args.punches} punches")
+    simulator.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -37,46 +37,264 @@ from PyQt5.QtWidgets import (
     QHeaderView,
     QTableWidget,
     QTableWidgetItem,
-    QLineEdit
+    QLineEdit,
+    QFileDialog
 )
 from modules.data_converter import DataConverter
 from modules.zk_interaction_utils import ZKDeviceController
 from modules.settings_windows import SettingsWindow
-from modules.database import DatabaseManager
+from modules.database import DatabaseManager, name_matches, normalize_name
+from modules.attendance_batch import AttendanceBatch
+from modules.device_harvester import harvest_all_devices
+from modules.session_manager import DeviceSessionManager
+from modules.spreadsheet_importer import import_attendance_files
+from modules.db_writer import DatabaseWriter
+from contextlib import nullcontext
 import json
 import os
 
+# Rows fetched per scroll step in the Reports tab
+HISTORY_PAGE_SIZE = 50
+SESSION_PAGE_SIZE = 1000
+
 class ExportWorker(QThread):
     finished = pyqtSignal(str)
     error = pyqtSignal(str)
 
-    def __init__(self, device_controller, start_date, end_date):
+    def __init__(self, device_controller, start_date, end_date, db_manager=None, lock=None):
         super().__init__()
         self.device_controller = device_controller
         self.start_date = start_date
         self.end_date = end_date
+        # When set, sync incrementally and export from the local store
+        self.db_manager = db_manager
+        # Session lock, keeps keepalives off the socket during the transfer
+        self.lock = lock or nullcontext()
 
     def run(self):
         try:
-            # Retrieve Data
-            attendance_data = self.device_controller.retrieve_attendance_with_user_names(
-                start_date=self.start_date, 
-                end_date=self.end_date
-            )
+            # Retrieve and convert batch by batch, nothing holds the whole log
+            converter = DataConverter()
+            lockouts_before = len(self.device_controller.lockout_log)
+            with self.lock:
+                if self.db_manager:
+                    self.device_controller.sync_attendance(self.db_manager)
+                    # An unchanged range is copied from the last export instead of written again
+                    file_path, count, reused = converter.convert_punches_to_file(
+                        self.db_manager,
+                        self.device_controller.device_key,
+                        start_date=self.start_date,
+                        end_date=self.end_date
+                    )
+                else:
+                    # Decoded, merged and filtered as columns; the file is written after the lock
+                    frame = self.device_controller.retrieve_attendance_frame(
+                        start_date=self.start_date,
+                        end_date=self.end_date
+                    )
+            if not self.db_manager:
+                file_path, count, reused = converter.convert_att_frame_to_file(frame), len(frame), False
             
-            if not attendance_data:
+            if not count:
+                os.remove(file_path)
                 self.finished.emit("No attendance data retrieved for the selected range.")
                 return
 
-            # Convert to File
-            converter = DataConverter(file_format='excel')
-            converter.convert_att_to_file(attendance_data)
-            
-            count = len(attendance_data)
-            self.finished.emit(f"Successfully exported {count} records!")
+            message = f"Successfully exported {count} records!"
+            if reused:
+                message += " (unchanged since the last export, file reused)"
+            locked = sum(l["seconds"] for l in self.device_controller.lockout_log[lockouts_before:])
+            if locked:
+                message += f" (device locked {locked:.2f}s)"
+            self.finished.emit(message)
+
+        except Exception as e:
+            self.error.emit(str(e))
+        finally:
+            # The worker thread's own store connections, the user cache is read through the controller's
+            db_manager = self.db_manager or self.device_controller.db_manager
+            if db_manager:
+                db_manager.release_thread()
+
+
+class HarvestWorker(QThread):
+    finished = pyqtSignal(str)
+    error = pyqtSignal(str)
+
+    def __init__(self, devices, start_date, end_date, session_manager=None):
+        super().__init__()
+        self.devices = devices
+        self.start_date = start_date
+        self.end_date = end_date
+        self.session_manager = session_manager
+
+    def run(self):
+        try:
+            harvest = harvest_all_devices(
+                self.devices, self.start_date, self.end_date,
+                session_manager=self.session_manager
+            )
+            records = harvest["records"]
+
+            if records:
+                converter = DataConverter()
+                converter.convert_att_to_file(records)
+
+            lines = [f"{name}: {len(recs)} records" for name, recs in harvest["results"].items()]
+            lines += [f"{name}: FAILED ({err})" for name, err in harvest["errors"].items()]
+            if records:
+                self.finished.emit(f"Successfully exported {len(records)} records!\n" + "\n".join(lines))
+            else:
+                self.finished.emit("No attendance data retrieved from any device.\n" + "\n".join(lines))
+
+        except Exception as e:
+            self.error.emit(str(e))
 
+
+class ImportWorker(QThread):
+    progress = pyqtSignal(int, int, str, int)
+    finished = pyqtSignal(str)
+    error = pyqtSignal(str)
+
+    def __init__(self, db_manager, paths, device, device_name=None):
+        super().__init__()
+        self.db_manager = db_manager
+        self.paths = paths
+        self.device = device
+        self.device_name = device_name
+
+    def run(self):
+        try:
+            summary = import_attendance_files(
+                self.db_manager, self.paths, self.device,
+                device_name=self.device_name, progress=self.progress.emit
+            )
+            message = (f"Imported {summary['files']} file(s) with {summary['records']} records "
+                       f"({summary['new']} new punches). Skipped {summary['skipped']} already imported.")
+            if summary["failed"]:
+                message += "\n" + "\n".join(
+                    f"{os.path.basename(path)}: FAILED ({err})" for path, err in summary["failed"].items()
+                )
+            self.finished.emit(message)
         except Exception as e:
             self.error.emit(str(e))
+        finally:
+            self.db_manager.release_thread()
+
+
+class ReportFileWorker(QThread):
+    finished = pyqtSignal(str)
+    error = pyqtSignal(str)
+
+    def __init__(self, records):
+        super().__init__()
+        self.records = records
+
+    def run(self):
+        try:
+            converter = DataConverter()
+            self.finished.emit(converter.convert_att_to_file(self.records))
+        except Exception as e:
+            self.error.emit(str(e))
+
+
+class PreviewWorker(QThread):
+    # AttendanceBatch of the punches to show
+    finished = pyqtSignal(object)
+    error = pyqtSignal(str)
+
+    def __init__(self, device_controller, db_manager, device_key, start_date, end_date, name_filter,
+                 incremental, lock=None):
+        super().__init__()
+        self.device_controller = device_controller
+        self.db_manager = db_manager
+        self.device_key = device_key
+        self.start_date = start_date
+        self.end_date = end_date
+        self.name_filter = name_filter
+        self.incremental = incremental
+        # Session lock, keeps keepalives off the socket during the transfer
+        self.lock = lock or nullcontext()
+
+    def run(self):
+        try:
+            if self.incremental:
+                # The sync writes on this thread, the window never waits on the store
+                if self.device_controller:
+                    with self.lock:
+                        self.device_controller.sync_attendance(self.db_manager)
+                # Name search runs on the local FTS index
+                if self.name_filter:
+                    records = self.db_manager.search_punches(
+                        self.device_key, self.name_filter, self.start_date, self.end_date
+                    )
+                else:
+                    records = self.db_manager.get_punches(self.device_key, self.start_date, self.end_date)
+            else:
+                with self.lock:
+                    frame = self.device_controller.retrieve_attendance_frame(self.start_date, self.end_date)
+
+                # Filter by Name Client-Side, same rule as search_punches,
+                # checked once per distinct name
+                terms = normalize_name(self.name_filter).split()
+                if terms:
+                    names = [name for name in frame["Name"].cat.categories if name_matches(name, terms)]
+                    frame = frame[frame["Name"].isin(names)]
+                records = AttendanceBatch.from_frame(frame)
+            self.finished.emit(records)
+        except Exception as e:
+            self.error.emit(str(e))
+        finally:
+            self.db_manager.release_thread()
+
+
+class LiveCaptureWorker(QThread):
+    punch_captured = pyqtSignal(str, dict)
+    error = pyqtSignal(str, str)
+
+    def __init__(self, device_config, db_manager):
+        super().__init__()
+        self.device_config = device_config
+        self.db_manager = db_manager
+        self.device_controller = None
+        self._stopped = False
+
+    def run(self):
+        name = self.device_config.get("name", self.device_config.get("ip"))
+        try:
+            # Own connection, live capture keeps the socket busy
+            self.device_controller = ZKDeviceController(
+                ip_address=self.device_config["ip"],
+                port=self.device_config["port"],
+                timeout=self.device_config["timeout"],
+                password=self.device_config["password"],
+                db_manager=self.db_manager,
+                ommit_ping=self.device_config.get("ommit_ping", False),
+            )
+            self.device_controller.create_zk_instance()
+            self.device_controller.connect_to_device()
+
+            for record in self.device_controller.capture_live_punches(self.db_manager):
+                if self._stopped:
+                    break
+                if record:
+                    self.punch_captured.emit(name, record)
+
+        except Exception as e:
+            if not self._stopped:
+                self.error.emit(name, str(e))
+        finally:
+            if self.device_controller and self.device_controller.connection:
+                try:
+                    self.device_controller.disconnect_from_device()
+                except ValueError:
+                    pass
+            self.db_manager.release_thread()
+
+    def stop(self):
+        self._stopped = True
+        if self.device_controller:
+            self.device_controller.stop_live_capture()
 
 
 class ZKGInterface(QWidget):
@@ -84,7 +302,20 @@ class ZKGInterface(QWidget):
         super().__init__()
         self.setObjectName("MainWindow")
         self.device_controller = None
+        self.active_session = None
+        self.live_workers = []
+        # Continuation tokens for the paged Reports tables, None when nothing is left
+        self.history_token = None
+        self.session_token = None
+        self.current_history_export_id = None
         self.db_manager = DatabaseManager()
+        self.session_manager = DeviceSessionManager(db_manager=self.db_manager)
+        # GUI-side writes go through the writer thread, job id -> (on_done, on_error)
+        self.pending_writes = {}
+        self.db_writer = DatabaseWriter(self.db_manager)
+        self.db_writer.job_finished.connect(self.on_write_finished)
+        self.db_writer.job_failed.connect(self.on_write_failed)
+        self.db_writer.start()
         self.load_styles()
         self.init_ui()
         self.closeEvent = self.on_close
@@ -207,6 +438,24 @@ class ZKGInterface(QWidget):
         self.btn_export_users.setCursor(Qt.PointingHandCursor)
         self.btn_export_users.clicked.connect(self.export_users_data)
         controls_layout.addWidget(self.btn_export_users)
+
+        # Incremental Sync
+        self.chk_incremental = QCheckBox("Incremental Sync (only download new punches)")
+        self.chk_incremental.setStyleSheet("color: white; font-size: 14px;")
+        self.chk_incremental.setChecked(True)
+        controls_layout.addWidget(self.chk_incremental)
+
+        # Short Lock-Out
+        self.chk_short_lock = QCheckBox("Lock device only during transfers")
+        self.chk_short_lock.setStyleSheet("color: white; font-size: 14px;")
+        self.chk_short_lock.setChecked(True)
+        controls_layout.addWidget(self.chk_short_lock)
+
+        # Live Capture
+        self.btn_live_capture = QPushButton("START LIVE CAPTURE")
+        self.btn_live_capture.setCursor(Qt.PointingHandCursor)
+        self.btn_live_capture.clicked.connect(self.toggle_live_capture)
+        controls_layout.addWidget(self.btn_live_capture)
         
         dashboard_layout.addWidget(controls_frame)
 
@@ -254,6 +503,11 @@ class ZKGInterface(QWidget):
         self.btn_export_attendance.clicked.connect(self.export_attendance_data)
         filter_layout.addWidget(self.btn_export_attendance)
 
+        self.btn_harvest_all = QPushButton("HARVEST ALL DEVICES")
+        self.btn_harvest_all.setCursor(Qt.PointingHandCursor)
+        self.btn_harvest_all.clicked.connect(self.harvest_all_devices)
+        filter_layout.addWidget(self.btn_harvest_all)
+
         dashboard_layout.addWidget(filter_frame)
         dashboard_layout.addStretch()
 
@@ -281,13 +535,13 @@ class ZKGInterface(QWidget):
         self.rep_date_to.setDisplayFormat("yyyy-MM-dd HH:mm")
         self.rep_date_to.setCalendarPopup(True)
         
-        btn_refresh_preview = QPushButton("Load & Preview Data")
-        btn_refresh_preview.clicked.connect(self.load_preview_data)
-        btn_refresh_preview.setStyleSheet("background-color: #00f3ff; color: #121212; border-radius: 5px; padding: 5px;")
+        self.btn_refresh_preview = QPushButton("Load & Preview Data")
+        self.btn_refresh_preview.clicked.connect(self.load_preview_data)
+        self.btn_refresh_preview.setStyleSheet("background-color: #00f3ff; color: #121212; border-radius: 5px; padding: 5px;")
         
         rep_filter_layout.addWidget(QLabel("Name:"), 0, 0)
         rep_filter_layout.addWidget(self.rep_search_name, 0, 1)
-        rep_filter_layout.addWidget(btn_refresh_preview, 0, 2)
+        rep_filter_layout.addWidget(self.btn_refresh_preview, 0, 2)
         
         rep_filter_layout.addWidget(QLabel("From:"), 1, 0)
         rep_filter_layout.addWidget(self.rep_date_from, 1, 1)
@@ -303,6 +557,7 @@ class ZKGInterface(QWidget):
         header = self.data_table.horizontalHeader()
         header.setSectionResizeMode(QHeaderView.Stretch)
         self.data_table.setStyleSheet("QTableWidget { background: rgba(0,0,0,0.2); color: white; gridline-color: #333; } QHeaderView::section { background: #1a1a2e; color: #00f3ff; }")
+        self.data_table.verticalScrollBar().valueChanged.connect(self.on_report_scroll)
         reports_layout.addWidget(self.data_table)
         
         # Export from Report
@@ -322,6 +577,7 @@ class ZKGInterface(QWidget):
         self.history_table.setSelectionBehavior(QTableWidget.SelectRows)
         self.history_table.setSelectionMode(QTableWidget.SingleSelection)
         self.history_table.setFixedHeight(120)
+        self.history_table.verticalScrollBar().valueChanged.connect(self.on_history_scroll)
         reports_layout.addWidget(self.history_table)
         
         # History Actions
@@ -338,9 +594,13 @@ class ZKGInterface(QWidget):
         btn_del_session.clicked.connect(self.delete_history_session)
         btn_del_session.setStyleSheet("background-color: #ff3333; color: white;")
         
+        self.btn_import_history = QPushButton("Import Old Exports")
+        self.btn_import_history.clicked.connect(self.import_history_files)
+        
         hist_action_layout.addWidget(btn_refresh_hist)
         hist_action_layout.addWidget(btn_load_session)
         hist_action_layout.addWidget(btn_del_session)
+        hist_action_layout.addWidget(self.btn_import_history)
         
         reports_layout.addLayout(hist_action_layout)
 
@@ -435,15 +695,17 @@ class ZKGInterface(QWidget):
 
             self.status_bar.showMessage(f"Connecting to {device_config.get('name', 'Device')}...")
             
-            self.device_controller = ZKDeviceController(
-                ip_address=device_config["ip"],
-                port=device_config["port"],
-                timeout=device_config["timeout"],
-                password=device_config["password"],
-            )
-            self.device_controller.create_zk_instance()
-            self.device_controller.connect_to_device()
-            self.device_controller.disable_device()
+            # Reuse the live session if we talked to this device before
+            session = self.session_manager.get_session(device_config)
+            with session.lock:
+                if not session.is_connected:
+                    session.connect()
+                # Short lock keeps the terminal usable while we are connected
+                session.controller.short_lock = self.chk_short_lock.isChecked()
+                if not session.controller.short_lock:
+                    session.controller.disable_device()
+            self.active_session = session
+            self.device_controller = session.controller
             
             self.btn_connect.setText('DISCONNECT')
             self.btn_connect.setStyleSheet("border-color: #ff3333; color: #ff3333;")
@@ -463,11 +725,19 @@ class ZKGInterface(QWidget):
             self.show_error_dialog(f"Error connecting to device: {e}")
             self.status_bar.showMessage("Connection Failed")
 
-    def disconnect_from_device(self):
+    def disconnect_from_device(self, keep_session=False):
         try:
             if self.device_controller:
-                self.device_controller.disconnect_from_device()
+                session = self.active_session
+                if keep_session:
+                    # Leave the session connected for later, just unlock the terminal
+                    with session.lock:
+                        if session.is_connected:
+                            session.controller.enable_device()
+                else:
+                    self.session_manager.close(session.device_config)
                 self.device_controller = None
+                self.active_session = None
                 
                 self.btn_connect.setText('CONNECT DEVICE')
                 self.btn_connect.setStyleSheet("") # Revert to default stylesheet style (neon purple)
@@ -498,12 +768,23 @@ class ZKGInterface(QWidget):
         else:
             self.show_error_dialog("Please connect to the device first")
 
+    def device_lock(self):
+        if self.active_session:
+            return self.active_session.lock
+        return nullcontext()
+
     def export_users_data(self):
         try:
             self.status_bar.showMessage("Exporting Users...")
-            users_data = self.device_controller.retrieve_users_data()
+            with self.device_lock():
+                users_data = self.device_controller.retrieve_users_data()
+                # Fresh download anyway, use it to refresh the name cache;
+                # the store copy is saved by the writer, not on this thread
+                if users_data:
+                    self.device_controller.update_user_cache(users_data, store=False)
             if users_data:
-                converter = DataConverter(file_format='excel')
+                self.submit_write(self.device_controller.save_user_cache)
+                converter = DataConverter()
                 converter.convert_users_to_file(users_data)
                 self.status_bar.showMessage("Users Exported Successfully")
                 QMessageBox.information(self, "Success", "Users data exported successfully!")
@@ -527,7 +808,8 @@ class ZKGInterface(QWidget):
         self.status_bar.showMessage("Exporting Data...")
 
         # 3. Setup Worker
-        self.worker = ExportWorker(self.device_controller, start_date, end_date)
+        db_manager = self.db_manager if self.chk_incremental.isChecked() else None
+        self.worker = ExportWorker(self.device_controller, start_date, end_date, db_manager, self.device_lock())
         
         # 4. Connect Signals
         self.worker.finished.connect(self.on_export_finished)
@@ -536,6 +818,78 @@ class ZKGInterface(QWidget):
         # 5. Start
         self.worker.start()
 
+    def harvest_all_devices(self):
+        devices = read_settings().get("devices", [])
+        if not devices:
+            self.show_error_dialog("No devices configured. Please go to Settings.")
+            return
+
+        start_date = None
+        end_date = None
+        if self.chk_filter.isChecked():
+            start_date = self.date_from.dateTime().toPyDateTime()
+            end_date = self.date_to.dateTime().toPyDateTime()
+
+        self.progress_bar.setVisible(True)
+        self.btn_harvest_all.setEnabled(False)
+        self.status_bar.showMessage(f"Harvesting {len(devices)} devices...")
+
+        self.harvest_worker = HarvestWorker(devices, start_date, end_date, self.session_manager)
+        self.harvest_worker.finished.connect(self.on_harvest_finished)
+        self.harvest_worker.error.connect(self.on_harvest_error)
+        self.harvest_worker.start()
+
+    def on_harvest_finished(self, message):
+        self.progress_bar.setVisible(False)
+        self.btn_harvest_all.setEnabled(True)
+        self.status_bar.showMessage(message.splitlines()[0])
+        if "successfully" in message.lower():
+             QMessageBox.information(self, "Harvest Complete", message)
+        else:
+             QMessageBox.warning(self, "Harvest Info", message)
+
+    def on_harvest_error(self, message):
+        self.progress_bar.setVisible(False)
+        self.btn_harvest_all.setEnabled(True)
+        self.status_bar.showMessage("Harvest Failed")
+        self.show_error_dialog(f"Error harvesting devices: {message}")
+
+    def toggle_live_capture(self):
+        if self.live_workers:
+            self.stop_live_capture()
+            return
+
+        devices = read_settings().get("devices", [])
+        if not devices:
+            self.show_error_dialog("No devices configured. Please go to Settings.")
+            return
+
+        for device_config in devices:
+            worker = LiveCaptureWorker(device_config, self.db_manager)
+            worker.punch_captured.connect(self.on_live_punch)
+            worker.error.connect(self.on_live_capture_error)
+            worker.start()
+            self.live_workers.append(worker)
+
+        self.btn_live_capture.setText("STOP LIVE CAPTURE")
+        self.status_bar.showMessage(f"Live capture running on {len(devices)} devices")
+
+    def stop_live_capture(self):
+        for worker in self.live_workers:
+            worker.stop()
+        # Workers notice within one capture timeout
+        for worker in self.live_workers:
+            worker.wait()
+        self.live_workers = []
+        self.btn_live_capture.setText("START LIVE CAPTURE")
+        self.status_bar.showMessage("Live capture stopped")
+
+    def on_live_punch(self, device_name, record):
+        self.status_bar.showMessage(f"[{device_name}] {record['Name']} {record['Type']} at {record['Time']}")
+
+    def on_live_capture_error(self, device_name, message):
+        self.status_bar.showMessage(f"Live capture stopped on {device_name}: {message}")
+
     def on_export_finished(self, message):
         self.progress_bar.setVisible(False)
         self.btn_export_attendance.setEnabled(True)
@@ -585,44 +939,76 @@ class ZKGInterface(QWidget):
         with open('settings.json', 'w') as file:
             json.dump(settings, file)
             
-        # Disconnect if switching
+        # Detach if switching, the session stays alive for when we come back
         if self.device_controller:
-            self.disconnect_from_device()
+            self.disconnect_from_device(keep_session=True)
 
     # --- Reports Logic ---
     def load_preview_data(self):
-        if not self.device_controller or not self.device_controller.connection:
+        connected = bool(self.device_controller and self.device_controller.connection)
+        incremental = self.chk_incremental.isChecked()
+        # The local store can be searched offline, a direct pull needs the device
+        if not connected and not incremental:
             self.show_error_dialog("Please connect to a device first.")
             return
 
         try:
             start_date = self.rep_date_from.dateTime().toPyDateTime()
             end_date = self.rep_date_to.dateTime().toPyDateTime()
-            name_filter = self.rep_search_name.text().lower()
-            
-            self.status_bar.showMessage("Loading data...")
-            data = self.device_controller.retrieve_attendance_with_user_names(start_date, end_date)
-            
-            # Filter by Name Client-Side
-            filtered_data = []
-            for record in data:
-                if not name_filter or name_filter in record["Name"].lower():
-                    filtered_data.append(record)
-            
-            # Populate Table
-            self.data_table.setRowCount(len(filtered_data))
-            for i, row in enumerate(filtered_data):
-                self.data_table.setItem(i, 0, QTableWidgetItem(str(row["User ID"])))
-                self.data_table.setItem(i, 1, QTableWidgetItem(str(row["Name"])))
-                self.data_table.setItem(i, 2, QTableWidgetItem(str(row["Time"])))
-                self.data_table.setItem(i, 3, QTableWidgetItem(str(row["Type"])))
-                self.data_table.setItem(i, 4, QTableWidgetItem(str(row["Status"])))
-                
-            self.current_report_data = filtered_data
-            self.status_bar.showMessage(f"Loaded {len(filtered_data)} records.")
-            
+            name_filter = self.rep_search_name.text().strip()
+            device_key = self.device_controller.device_key if connected else self.selected_device_key()
         except Exception as e:
             self.show_error_dialog(str(e))
+            return
+
+        self.status_bar.showMessage("Loading data...")
+        self.progress_bar.setVisible(True)
+        self.btn_refresh_preview.setEnabled(False)
+        self.preview_worker = PreviewWorker(
+            self.device_controller if connected else None, self.db_manager, device_key,
+            start_date, end_date, name_filter, incremental, self.device_lock()
+        )
+        self.preview_worker.finished.connect(
+            lambda records: self.on_preview_loaded(records, device_key, connected)
+        )
+        self.preview_worker.error.connect(self.on_preview_error)
+        self.preview_worker.start()
+
+    def on_preview_loaded(self, records, device_key, connected):
+        self.progress_bar.setVisible(False)
+        self.btn_refresh_preview.setEnabled(True)
+
+        # Stop paging any history session still in the table
+        self.current_history_export_id = None
+        self.session_token = None
+
+        # Populate Table
+        self.data_table.setRowCount(0)
+        self.append_report_rows(records)
+
+        self.current_report_data = records
+        self.current_report_device = device_key
+        if connected:
+            self.status_bar.showMessage(f"Loaded {len(records)} records.")
+        else:
+            self.status_bar.showMessage(f"Loaded {len(records)} records from the local store.")
+
+    def on_preview_error(self, message):
+        self.progress_bar.setVisible(False)
+        self.btn_refresh_preview.setEnabled(True)
+        self.status_bar.showMessage("Loading failed")
+        self.show_error_dialog(message)
+
+    def selected_device_key(self):
+        # Store key (ip:port) of the device picked in the combo, no connection needed
+        settings = read_settings()
+        devices = settings.get("devices", [])
+        if not devices:
+            raise ValueError("No devices configured. Please go to Settings.")
+        active_index = settings.get("last_active_index", 0)
+        if active_index >= len(devices):
+            active_index = 0
+        return f"{devices[active_index]['ip']}:{devices[active_index]['port']}"
 
     def export_report_data(self):
         if not hasattr(self, 'current_report_data') or not self.current_report_data:
@@ -630,44 +1016,106 @@ class ZKGInterface(QWidget):
             return
             
         try:
-            converter = DataConverter(file_format='excel')
-            file_path = converter.convert_att_to_file(self.current_report_data)
-            
-            # Log to DB
-            device_name = "Unknown"
-            if self.device_combo.count() > 0:
-                device_name = self.device_combo.currentText()
-            
-            # 1. Log Export
-            export_id = self.db_manager.log_export(
-                device_name=device_name,
-                record_count=len(self.current_report_data),
-                file_path=file_path,
-                start_date=self.rep_date_from.dateTime().toString(),
-                end_date=self.rep_date_to.dateTime().toString()
-            )
-            
-            # 2. Save Deep Records
-            self.db_manager.save_export_records(export_id, self.current_report_data)
-            
-            self.load_history_data() # Refresh history table
-            QMessageBox.information(self, "Success", f"Exported {len(self.current_report_data)} records to {file_path}")
-            
+            # A history session may only be partly loaded into the table
+            if self.current_history_export_id is not None and self.session_token is not None:
+                self.current_report_data = self.db_manager.get_export_records(self.current_history_export_id)
+                self.session_token = None
         except Exception as e:
             self.show_error_dialog(f"Export failed: {e}")
+            return
+
+        # The table keeps growing on scroll, export what is loaded now
+        records = self.current_report_data.copy()
+        device_name = "Unknown"
+        if self.device_combo.count() > 0:
+            device_name = self.device_combo.currentText()
+        export = {
+            "records": records,
+            "device": getattr(self, 'current_report_device', None),
+            "device_name": device_name,
+            "start_date": self.rep_date_from.dateTime().toPyDateTime(),
+            "end_date": self.rep_date_to.dateTime().toPyDateTime(),
+        }
+
+        # Write the file off the GUI thread, then queue the log for the writer
+        self.btn_export_report.setEnabled(False)
+        self.status_bar.showMessage(f"Exporting {len(records)} records...")
+        self.report_worker = ReportFileWorker(records)
+        self.report_worker.finished.connect(lambda file_path: self.log_report_export(export, file_path))
+        self.report_worker.error.connect(self.on_report_export_error)
+        self.report_worker.start()
+
+    def log_report_export(self, export, file_path):
+        db_manager = self.db_manager
+
+        def write():
+            # Runs on the writer thread, session and records commit together
+            export_id = db_manager.log_export(
+                device_name=export["device_name"],
+                record_count=len(export["records"]),
+                file_path=file_path,
+                start_date=export["start_date"],
+                end_date=export["end_date"]
+            )
+            db_manager.save_export_records(export_id, export["records"], export["device"])
+            return file_path
+
+        self.submit_write(write, on_done=self.on_report_exported, on_error=self.on_report_export_error)
+
+    def on_report_exported(self, file_path):
+        self.btn_export_report.setEnabled(True)
+        self.load_history_data() # Refresh history table
+        self.status_bar.showMessage(f"Exported to {file_path}")
+        QMessageBox.information(self, "Success", f"Exported records to {file_path}")
+
+    def on_report_export_error(self, message):
+        self.btn_export_report.setEnabled(True)
+        self.status_bar.showMessage("Export Failed")
+        self.show_error_dialog(f"Export failed: {message}")
+
+    def submit_write(self, func, *args, on_done=None, on_error=None):
+        job_id = self.db_writer.submit(func, *args)
+        self.pending_writes[job_id] = (on_done, on_error)
+
+    def on_write_finished(self, job_id, result):
+        on_done, _on_error = self.pending_writes.pop(job_id, (None, None))
+        if on_done:
+            on_done(result)
+
+    def on_write_failed(self, job_id, message):
+        _on_done, on_error = self.pending_writes.pop(job_id, (None, None))
+        if on_error:
+            on_error(message)
+        else:
+            self.status_bar.showMessage(f"Saving to the local database failed: {message}")
 
     def load_history_data(self):
         try:
-            history = self.db_manager.get_export_history()
-            self.history_table.setRowCount(len(history))
-            # Rows: (0:id, 1:device, 2:count, 3:start, 4:end, 5:path, 6:time)
-            
-            for i, row in enumerate(history):
-                self.history_table.setItem(i, 0, QTableWidgetItem(str(row[0]))) # ID (Hidden)
-                self.history_table.setItem(i, 1, QTableWidgetItem(str(row[6]))) # Timestamp
-                self.history_table.setItem(i, 2, QTableWidgetItem(str(row[1]))) # Device
-                self.history_table.setItem(i, 3, QTableWidgetItem(str(row[2]))) # Count
-                self.history_table.setItem(i, 4, QTableWidgetItem(str(row[5]))) # File Path
+            history, self.history_token = self.db_manager.get_export_history_page(HISTORY_PAGE_SIZE)
+            self.history_table.setRowCount(0)
+            self.append_history_rows(history)
+        except Exception as e:
+            print(f"Error loading history: {e}")
+
+    def append_history_rows(self, history):
+        # Rows: (0:id, 1:device, 2:count, 3:start, 4:end, 5:path, 6:time)
+        offset = self.history_table.rowCount()
+        self.history_table.setRowCount(offset + len(history))
+        for i, row in enumerate(history, offset):
+            self.history_table.setItem(i, 0, QTableWidgetItem(str(row[0]))) # ID (Hidden)
+            self.history_table.setItem(i, 1, QTableWidgetItem(str(row[6]))) # Timestamp
+            self.history_table.setItem(i, 2, QTableWidgetItem(str(row[1]))) # Device
+            self.history_table.setItem(i, 3, QTableWidgetItem(str(row[2]))) # Count
+            self.history_table.setItem(i, 4, QTableWidgetItem(str(row[5]))) # File Path
+
+    def on_history_scroll(self, value):
+        if self.history_token is None or value < self.history_table.verticalScrollBar().maximum():
+            return
+        try:
+            history, self.history_token = self.db_manager.get_export_history_page(
+                HISTORY_PAGE_SIZE, self.history_token
+            )
+            self.append_history_rows(history)
         except Exception as e:
             print(f"Error loading history: {e}")
 
@@ -679,28 +1127,49 @@ class ZKGInterface(QWidget):
 
         try:
             export_id = int(self.history_table.item(row, 0).text())
-            records = self.db_manager.get_export_records(export_id)
+            total = self.history_table.item(row, 3).text()
+            records, token = self.db_manager.get_export_records_page(export_id, SESSION_PAGE_SIZE)
             
             if not records:
                 QMessageBox.information(self, "Info", "No detailed records found for this session (it might be an old export).")
                 return
 
-            # Populate Main Table
-            self.data_table.setRowCount(len(records))
-            for i, row_data in enumerate(records):
-                self.data_table.setItem(i, 0, QTableWidgetItem(str(row_data["User ID"])))
-                self.data_table.setItem(i, 1, QTableWidgetItem(str(row_data["Name"])))
-                self.data_table.setItem(i, 2, QTableWidgetItem(str(row_data["Time"])))
-                self.data_table.setItem(i, 3, QTableWidgetItem(str(row_data["Type"])))
-                self.data_table.setItem(i, 4, QTableWidgetItem(str(row_data["Status"])))
+            # Populate Main Table, more pages are fetched on scroll
+            self.session_token = None
+            self.data_table.setRowCount(0)
+            self.append_report_rows(records)
             
             # Set as current data for re-export
             self.current_report_data = records
-            self.status_bar.showMessage(f"Loaded session with {len(records)} records.")
+            # History records carry their own device
+            self.current_report_device = None
+            self.current_history_export_id = export_id
+            self.session_token = token
+            self.status_bar.showMessage(f"Loaded session, showing {len(records)} of {total} records.")
             
         except Exception as e:
             self.show_error_dialog(f"Error loading session: {e}")
 
+    def append_report_rows(self, records):
+        # records is an AttendanceBatch, rows() skips building a dict per punch
+        offset = self.data_table.rowCount()
+        self.data_table.setRowCount(offset + len(records))
+        for i, row_data in enumerate(records.rows(), offset):
+            for column, value in enumerate(row_data):
+                self.data_table.setItem(i, column, QTableWidgetItem(str(value)))
+
+    def on_report_scroll(self, value):
+        if self.session_token is None or value < self.data_table.verticalScrollBar().maximum():
+            return
+        try:
+            records, self.session_token = self.db_manager.get_export_records_page(
+                self.current_history_export_id, SESSION_PAGE_SIZE, self.session_token
+            )
+            self.append_report_rows(records)
+            self.current_report_data.extend(records)
+        except Exception as e:
+            self.show_error_dialog(f"Error loading session: {e}")
+
     def delete_history_session(self):
         row = self.history_table.currentRow()
         if row < 0:
@@ -714,13 +1183,61 @@ class ZKGInterface(QWidget):
         )
         
         if confirm == QMessageBox.Yes:
-            try:
-                export_id = int(self.history_table.item(row, 0).text())
-                self.db_manager.delete_export(export_id)
-                self.load_history_data() # Refresh list
-                self.status_bar.showMessage("Session deleted.")
-            except Exception as e:
-                self.show_error_dialog(f"Delete failed: {e}")
+            export_id = int(self.history_table.item(row, 0).text())
+            self.submit_write(
+                self.db_manager.delete_export, export_id,
+                on_done=self.on_history_session_deleted,
+                on_error=lambda message: self.show_error_dialog(f"Delete failed: {message}")
+            )
+
+    def on_history_session_deleted(self, _result):
+        self.load_history_data() # Refresh list
+        self.status_bar.showMessage("Session deleted.")
+
+    def import_history_files(self):
+        settings = read_settings()
+        folder = QFileDialog.getExistingDirectory(
+            self, "Folder with attendance_*.xlsx exports", settings.get("export_path", "")
+        )
+        if not folder:
+            return
+
+        try:
+            device_key = self.selected_device_key()
+        except ValueError as e:
+            self.show_error_dialog(str(e))
+            return
+        device_name = self.device_combo.currentText() or device_key
+
+        self.progress_bar.setVisible(True)
+        self.btn_import_history.setEnabled(False)
+        self.status_bar.showMessage(f"Importing exports from {folder} as {device_name}...")
+
+        self.import_worker = ImportWorker(self.db_manager, [folder], device_key, device_name)
+        self.import_worker.progress.connect(self.on_import_progress)
+        self.import_worker.finished.connect(self.on_import_finished)
+        self.import_worker.error.connect(self.on_import_error)
+        self.import_worker.start()
+
+    def on_import_progress(self, done, total, file_path, rows):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+        self.status_bar.showMessage(f"Importing {done}/{total}: {os.path.basename(file_path)} ({rows} rows)")
+
+    def on_import_finished(self, message):
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setVisible(False)
+        self.btn_import_history.setEnabled(True)
+        self.status_bar.showMessage("Import finished")
+        self.load_history_data()
+        QMessageBox.information(self, "Import", message)
+
+    def on_import_error(self, message):
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setVisible(False)
+        self.btn_import_history.setEnabled(True)
+        self.status_bar.showMessage("Import failed")
+        self.show_error_dialog(f"Import failed: {message}")
 
     def open_settings(self):
         try:
@@ -734,11 +1251,14 @@ class ZKGInterface(QWidget):
             self.show_error_dialog(f"Could not load settings: {e}")
         
     def on_close(self, event):
-        if self.device_controller is not None:
-            try:
-                self.device_controller.disconnect_from_device()
-            except:
-                pass
+        try:
+            self.stop_live_capture()
+            self.session_manager.close_all()
+            # Queued writes are flushed before the window goes
+            self.db_writer.stop()
+            self.db_manager.close()
+        except:
+            pass
         event.accept()
 
 
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+"""
+DatabaseManager write/read benchmark.
+
+Compares the old open-per-call pattern (default rollback journal, one
+connect + commit per call) with the managed per-thread WAL connection and
+explicit bulk transactions, on a scratch database.
+
+    python tools/benchmark_db.py --rows 20000 --calls 2000
+"""
+from datetime import datetime, timedelta
+import argparse
+import tempfile
+import sqlite3
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.database import DatabaseManager
+
+INSERT_PUNCH = '''
+    INSERT OR IGNORE INTO punches (device, user_id, name, timestamp, punch_type, status)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+
+def make_records(count, offset=0):
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    return [{
+        "User ID": i % 3000,
+        "Name": f"User {i % 3000}",
+        "Time": start + timedelta(seconds=offset + i),
+        "Type": "Check-In",
+        "Status": 1
+    } for i in range(count)]
+
+
+def row(device, r):
+    return (device, r["User ID"], r["Name"], str(r["Time"]), r["Type"], r["Status"])
+
+
+def report(label, count, elapsed, unit):
+    print(f"{label:<44} {count / elapsed:12,.0f} {unit}/s  {elapsed / count * 1e6:9.1f} us/{unit[:-1]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark DatabaseManager connection handling")
+    parser.add_argument("--rows", type=int, default=20000, help="Rows for the bulk insert runs")
+    parser.add_argument("--calls", type=int, default=2000, help="Single-row calls for the latency runs")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Baseline: schema from DatabaseManager, then the old access pattern on a
+        # rollback-journal copy
+        baseline_path = os.path.join(workdir, "baseline.db")
+        DatabaseManager(baseline_path).close()
+        conn = sqlite3.connect(baseline_path)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+
+        managed = DatabaseManager(os.path.join(workdir, "managed.db"))
+
+        records = make_records(args.calls)
+        started = time.perf_counter()
+        for r in records:
+            conn = sqlite3.connect(baseline_path)
+            conn.execute(INSERT_PUNCH, row("bench", r))
+            conn.commit()
+            conn.close()
+        report("single insert, connect per call (old)", args.calls, time.perf_counter() - started, "calls")
+
+        started = time.perf_counter()
+        for r in records:
+            managed.save_punches("bench", [r])
+        report("single insert, managed WAL connection", args.calls, time.perf_counter() - started, "calls")
+
+        started = time.perf_counter()
+        for _ in range(args.calls):
+            conn = sqlite3.connect(baseline_path)
+            conn.execute("SELECT last_timestamp, record_count FROM device_sync_state WHERE device = ?", ("bench",))
+            conn.close()
+        report("point read, connect per call (old)", args.calls, time.perf_counter() - started, "calls")
+
+        started = time.perf_counter()
+        for _ in range(args.calls):
+            managed.get_sync_state("bench")
+        report("point read, managed WAL connection", args.calls, time.perf_counter() - started, "calls")
+
+        records = make_records(args.rows, offset=args.calls)
+        started = time.perf_counter()
+        for start in range(0, args.rows, 500):
+            conn = sqlite3.connect(baseline_path)
+            conn.executemany(INSERT_PUNCH, [row("bulk", r) for r in records[start:start + 500]])
+            conn.commit()
+            conn.close()
+        report("bulk 500/batch, commit per batch (old)", args.rows, time.perf_counter() - started, "rows")
+
+        started = time.perf_counter()
+        with managed.transaction():
+            for start in range(0, args.rows, 500):
+                managed.save_punches("bulk", records[start:start + 500])
+        report("bulk 500/batch, one managed transaction", args.rows, time.perf_counter() - started, "rows")
+
+        managed.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+"""
+DataConverter export benchmark.
+
+Times the old pandas DataFrame.to_excel path against the streaming
+writers in FILE_WRITERS, fed batch by batch like an incremental export.
+Each case runs in a fresh interpreter so its peak RSS is its own.
+
+    python tools/benchmark_export.py --records 200000
+    python tools/benchmark_export.py --records 1200000 --cases pandas excel
+"""
+from datetime import datetime, timedelta
+import argparse
+import resource
+import subprocess
+import tempfile
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.data_converter import DataConverter, FILE_WRITERS
+
+COLUMNS = ["User ID", "Name", "Time", "Type", "Status"]
+
+
+def make_batches(count, batch_size=5000):
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    for offset in range(0, count, batch_size):
+        yield [{
+            "User ID": i % 3000,
+            "Name": f"User {i % 3000}",
+            "Time": start + timedelta(seconds=20 * i),
+            "Type": "Check-In",
+            "Status": 1
+        } for i in range(offset, min(offset + batch_size, count))]
+
+
+def run_case(case, records, workdir):
+    # Child process: write the file, print "seconds peak_rss_kib file_name"
+    started = time.perf_counter()
+    if case == "pandas":
+        # What _convert_to_excel used to do: every record as a list, one DataFrame, to_excel
+        import pandas as pd
+
+        aslist = [[r[c] for c in COLUMNS] for batch in make_batches(records) for r in batch]
+        file_name = os.path.join(workdir, "pandas.xlsx")
+        pd.DataFrame(data=aslist, columns=COLUMNS).to_excel(file_name, index=False)
+    else:
+        converter = DataConverter(file_format=case)
+        converter.export_path = workdir
+        file_name, _count = converter.convert_att_batches_to_file(make_batches(records))
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is in KiB on Linux
+    print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, file_name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark DataConverter export formats")
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--cases", nargs="+", default=["pandas"] + list(FILE_WRITERS),
+                        help="pandas and/or file formats (default: all)")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # DataConverter reads settings.json from the working directory
+    os.chdir(ROOT)
+    if args.case:
+        run_case(args.case, args.records, args.workdir)
+        return 0
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for case in args.cases:
+            label = "excel via pandas (old)" if case == "pandas" else f"{case} streaming"
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--records", str(args.records),
+                 "--case", case, "--workdir", workdir],
+                capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                print(f"{label:<24} failed: {result.stderr.strip().splitlines()[-1]}")
+                continue
+            elapsed, peak, file_name = result.stdout.split(maxsplit=2)
+            elapsed, peak = float(elapsed), int(peak) / 1024
+            print(f"{label:<24} {elapsed:8.2f}s  {args.records / elapsed:10,.0f} rec/s  "
+                  f"{os.path.getsize(file_name.strip()) / 2**20:8.1f} MB file  {peak:8.1f} MB peak RSS")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
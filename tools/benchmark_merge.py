@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+"""
+Attendance merge/transform benchmark against the local ZK simulator.
+
+Times the per-record path (Attendance objects, merge_user_names dicts,
+Python date filter) against the columnar retrieve_attendance_frame, both
+on their own and feeding a CSV export. The raw log is transferred once and
+reused, so the timings are the transform alone.
+
+    python tools/benchmark_merge.py --punches 1000000 --users 3000
+"""
+import argparse
+import tempfile
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.zk_simulator import ZKSimulator, SyntheticDevice
+from modules.zk_interaction_utils import ZKDeviceController
+from modules.data_converter import DataConverter
+
+
+def timed(label, punches, fn):
+    started = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<34} {count:>9} records  {elapsed:8.3f}s  {punches / elapsed:12,.0f} rec/s")
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark per-record vs columnar attendance merge")
+    parser.add_argument("--punches", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=3000)
+    args = parser.parse_args(argv)
+
+    device = SyntheticDevice(users=args.users, punches=args.punches)
+    with ZKSimulator(device) as simulator:
+        controller = ZKDeviceController('127.0.0.1', simulator.port, 30, '', ommit_ping=True)
+        controller.create_zk_instance()
+        controller.connect_to_device()
+        controller.get_user_map()
+
+        # Middle half of the log, so the date filter has work to do
+        frame = controller.retrieve_attendance_frame()
+        times = frame["Time"].sort_values()
+        start_date = times.iloc[len(times) // 4].to_pydatetime()
+        end_date = times.iloc[3 * len(times) // 4].to_pydatetime()
+        del frame, times
+        print(f"{args.punches} punches, {args.users} users, filtering {start_date} .. {end_date}")
+
+        buffer = []
+
+        def transfer():
+            buffer.append(controller._read_attendance_buffer())
+            return len(buffer[0][0]) // buffer[0][1]
+
+        timed("raw transfer only", args.punches, transfer)
+        # From here on both paths decode the buffer already fetched, so only the transform is timed
+        controller._read_attendance_buffer = lambda: buffer[0]
+
+        timed("per-record merge (dicts)", args.punches,
+              lambda: sum(len(b) for b in controller.iter_attendance_with_user_names(start_date, end_date)))
+        timed("columnar merge (DataFrame)", args.punches,
+              lambda: len(controller.retrieve_attendance_frame(start_date, end_date)))
+
+        # DataConverter reads settings.json from the working directory
+        os.chdir(ROOT)
+        with tempfile.TemporaryDirectory() as workdir:
+            converter = DataConverter(file_format="csv")
+            converter.export_path = workdir
+            timed("per-record merge + csv export", args.punches, lambda: converter.convert_att_batches_to_file(
+                controller.iter_attendance_with_user_names(start_date, end_date))[1])
+
+            def columnar_export():
+                frame = controller.retrieve_attendance_frame(start_date, end_date)
+                converter.convert_att_frame_to_file(frame)
+                return len(frame)
+
+            timed("columnar merge + csv export", args.punches, columnar_export)
+
+        controller.disconnect_from_device()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
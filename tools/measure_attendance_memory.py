@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+"""
+Memory per punch of the record containers.
+
+Builds the same punches as (a) pyzk Attendance objects plus the dicts
+merge_user_names makes from them, (b) record dicts as the store used to
+return them, and (c) AttendanceBatches of --batch-size punches, the size
+iter_punches and iter_attendance_with_user_names yield, and prints the
+bytes each holds per punch as traced by tracemalloc. The batches of one
+stream share their tables of distinct user ids and names; a lone batch,
+which carries its own tables, is printed too. Exits with status 1 when the
+batch stream is not at least --min-ratio times smaller than the dicts, so
+it can gate CI:
+
+    python tools/measure_attendance_memory.py --punches 200000 --min-ratio 10
+"""
+from datetime import datetime, timedelta
+import argparse
+import tracemalloc
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.zk_interaction_utils import ZKDeviceController, PUNCH_TYPE_MAP
+
+
+def decoded_attendance(count, users):
+    # What iter_attendance_batches decodes: a fresh user id string and datetime per punch
+    from zk.attendance import Attendance
+
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    return [
+        Attendance(str(1000 + i % users), start + timedelta(seconds=20 * i), 1, i % 2, i % users)
+        for i in range(count)
+    ]
+
+
+def store_records(count, users):
+    # What iter_punches used to yield: a dict per row, sqlite3 hands out a new name string each time
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    return [{
+        "User ID": 1000 + i % users,
+        "Name": "".join(("User ", str(i % users))),
+        "Time": start + timedelta(seconds=20 * i),
+        "Type": PUNCH_TYPE_MAP[i % 2],
+        "Status": 1
+    } for i in range(count)]
+
+
+def traced(build):
+    # (object, bytes it keeps alive)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    value = build()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return value, retained
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure memory per punch of the record containers")
+    parser.add_argument("--punches", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=3000)
+    parser.add_argument("--batch-size", type=int, default=5000,
+                        help="Punches per AttendanceBatch, as iter_punches yields them")
+    parser.add_argument("--min-ratio", type=float, default=10.0,
+                        help="Fail unless AttendanceBatch is this many times smaller than the dicts")
+    args = parser.parse_args(argv)
+
+    user_map = {str(1000 + u): f"User {u}" for u in range(args.users)}
+
+    def device_path():
+        attendance = decoded_attendance(args.punches, args.users)
+        return attendance, ZKDeviceController.merge_user_names(None, attendance, user_map)
+
+    def batch_stream(attendance):
+        # What a consumer holding every yielded batch keeps
+        batches, previous = [], None
+        for start in range(0, len(attendance), args.batch_size):
+            previous = ZKDeviceController.batch_user_names(
+                None, attendance[start:start + args.batch_size], user_map, previous
+            )
+            batches.append(previous)
+        return batches
+
+    _, device_bytes = traced(device_path)
+    _, store_bytes = traced(lambda: store_records(args.punches, args.users))
+
+    attendance = decoded_attendance(args.punches, args.users)
+    _, batch_bytes = traced(lambda: batch_stream(attendance))
+    lone = attendance[:args.batch_size]
+    _, lone_bytes = traced(lambda: ZKDeviceController.batch_user_names(None, lone, user_map))
+    del attendance, lone
+
+    results = [
+        ("Attendance + merged dict", device_bytes),
+        ("record dicts (store)", store_bytes),
+        ("AttendanceBatch stream", batch_bytes),
+    ]
+    print(f"{args.punches} punches, {args.users} users, batches of {args.batch_size}")
+    for label, size in results:
+        print(f"{label:<28} {size / 2**20:9.1f} MB  {size / args.punches:8.1f} bytes/punch")
+    lone_count = min(args.batch_size, args.punches)
+    print(f"{'one AttendanceBatch alone':<28} {lone_bytes / 2**20:9.1f} MB  "
+          f"{lone_bytes / lone_count:8.1f} bytes/punch (its own user tables)")
+
+    ratio = store_bytes / batch_bytes
+    print(f"The AttendanceBatch stream is {ratio:.1f}x smaller than the record dicts "
+          f"({device_bytes / batch_bytes:.1f}x against Attendance + dict)")
+    if ratio < args.min_ratio:
+        print(f"FAIL: expected at least {args.min_ratio:.0f}x")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
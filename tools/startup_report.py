@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+"""
+Start-up timing report.
+
+Launches the GUI in a fresh interpreter under `python -X importtime`, stops
+as soon as the first window is shown, and prints the time-to-first-window
+with the slowest imports. Exits with status 1 when the budget is exceeded,
+so it can gate CI:
+
+    python tools/startup_report.py --budget 1.5
+"""
+import argparse
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAUNCH_SNIPPET = """
+import sys
+from PyQt5.QtWidgets import QApplication
+from modules.zkg_interface import ZKGInterface
+app = QApplication(sys.argv)
+window = ZKGInterface()
+window.show()
+app.processEvents()
+"""
+
+
+def parse_importtime(stderr):
+    # Lines look like "import time:   self [us] | cumulative | package"
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            cumulative = int(parts[1].strip())
+        except ValueError:
+            continue
+        name = parts[2].rstrip()
+        imports.append((cumulative, name.strip(), len(name) - len(name.lstrip())))
+    return imports
+
+
+def measure_startup():
+    # Run from a scratch copy of the config so the real hrms_data.db is not touched
+    with tempfile.TemporaryDirectory() as workdir:
+        shutil.copy(os.path.join(REPO_ROOT, "settings.json"), workdir)
+        shutil.copytree(os.path.join(REPO_ROOT, "assets"), os.path.join(workdir, "assets"))
+
+        env = dict(os.environ)
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+        env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", LAUNCH_SNIPPET],
+            cwd=workdir, env=env, capture_output=True, text=True
+        )
+        elapsed = time.perf_counter() - started
+
+    if result.returncode != 0:
+        raise RuntimeError(f"GUI failed to start:\n{result.stderr[-2000:]}")
+    return elapsed, parse_importtime(result.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure time-to-first-window against a budget")
+    parser.add_argument("--budget", type=float, default=1.5, help="Allowed time-to-first-window in seconds")
+    parser.add_argument("--runs", type=int, default=3, help="Launches to measure, the best one is reported")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest top-level imports to list")
+    args = parser.parse_args(argv)
+
+    runs = [measure_startup() for _ in range(args.runs)]
+    elapsed, imports = min(runs, key=lambda run: run[0])
+
+    print(f"Time to first window: {elapsed:.3f}s (best of {args.runs}, budget {args.budget:.3f}s)")
+    print("Slowest top-level imports:")
+    top_level = sorted((i for i in imports if i[2] <= 1), reverse=True)[:args.top]
+    for cumulative, name, _ in top_level:
+        print(f"  {cumulative / 1000:9.1f} ms  {name}")
+
+    if elapsed > args.budget:
+        print(f"FAIL: start-up exceeded budget by {elapsed - args.budget:.3f}s")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())